@@ -1,4 +1,7 @@
+import contextlib
+import threading
 import autogen
+import llm_client
 from utils import llama3
 
 
@@ -207,3 +210,83 @@ user_proxy = autogen.UserProxyAgent(
     default_auto_reply="default_auto_reply"
 )
 
+
+
+class AgentSet:
+    """
+    Copie indipendenti degli assistenti (ognuna con la propria storia delle conversazioni),
+    usate quando piu' articoli sono in esecuzione in parallelo. user_proxy resta condiviso:
+    la sua storia e' separata per destinatario.
+    """
+    TEMPLATES = {
+        "SemanticAnalyzer": SemanticAnalyzer,
+        "SalientSentenceEditor": SalientSentenceEditor,
+        "NarrativeModifier": NarrativeModifier,
+        "NumberModifier": NumberModifier,
+        "TitleEditor": TitleEditor,
+        "Detector": Detector,
+        "EvaluatorAgent": EvaluatorAgent,
+        "SalientTextRewriter": SalientTextRewriter,
+        "UniversalAgent": UniversalAgent,
+        "LLMFakenewsAgent": LLMFakenewsAgent,
+    }
+
+    def __init__(self, copy=True):
+        for attr, agent in self.TEMPLATES.items():
+            if copy:
+                agent = autogen.AssistantAgent(
+                    name=agent.name,
+                    system_message=agent.system_message,
+                    llm_config=agent.llm_config,
+                )
+                llm_client.enable_async_replies(agent)
+            setattr(self, attr, agent)
+
+    def all(self):
+        return [getattr(self, attr) for attr in self.TEMPLATES]
+
+    def clear_histories(self):
+        """Svuota le conversazioni degli agenti e quelle di user_proxy con ciascuno di essi."""
+        for agent in self.all():
+            agent.clear_history()
+            user_proxy.clear_history(agent)
+
+
+for _agent in AgentSet.TEMPLATES.values():
+    llm_client.enable_async_replies(_agent)
+
+DEFAULT_AGENTS = AgentSet(copy=False)
+_thread_local = threading.local()
+
+def thread_agents():
+    """Agenti del thread corrente: il thread principale usa quelli del modulo, ogni worker una propria copia."""
+    if threading.current_thread() is threading.main_thread():
+        return DEFAULT_AGENTS
+    if not hasattr(_thread_local, "agents"):
+        _thread_local.agents = AgentSet()
+    return _thread_local.agents
+
+
+async def a_chat(agent, message, clear_history=True, timeout=None, memo=None):
+    """Versione asincrona di user_proxy.initiate_chat(agent, ...): client HTTP condiviso, timeout e cancellazione."""
+    return await llm_client.a_chat(user_proxy, agent, message, clear_history=clear_history, timeout=timeout, memo=memo)
+
+def chat(agent, message, clear_history=True, timeout=None):
+    """Come a_chat, per il codice sincrono: la chiamata gira sul loop condiviso e il thread ne attende il risultato."""
+    memo = llm_client.current_memo()
+    return llm_client.run(a_chat(agent, message, clear_history=clear_history, timeout=timeout, memo=memo))
+
+
+@contextlib.contextmanager
+def article_scope(agents, max_tokens=None):
+    """
+    Conversazioni di un articolo: le chat nel blocco partono da una storia vuota e i loro prompt
+    restano entro max_tokens (stimati, None = nessun limite); all'uscita la storia viene svuotata,
+    cosi' testi e tentativi di un articolo non restano in memoria ne' finiscono nel successivo.
+    """
+    agents.clear_histories()
+    try:
+        with llm_client.context_scope(llm_client.ContextBudget(max_tokens)) as budget:
+            yield budget
+    finally:
+        agents.clear_histories()
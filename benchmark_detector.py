@@ -0,0 +1,53 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from detector import BACKENDS, load_model, bert_predict_with_chunking
+
+# Confronto tra backend del detector: accordo delle label e differenza delle probabilita'
+# rispetto al modello .pt (backend "torch"), piu' la latenza media per testo.
+
+
+def load_texts(file_path, limit):
+    df = pd.read_csv(file_path, delimiter=';', nrows=limit * 2)
+    df = df[['title', 'text']].dropna()
+    return df["text"].astype(str).tolist()[:limit]
+
+
+def run_backend(model, texts, batch_size, repeat):
+    bert_predict_with_chunking(model, texts[:1], batch_size=batch_size)  # warm-up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        probs = bert_predict_with_chunking(model, texts, batch_size=batch_size)
+        timings.append(time.perf_counter() - start)
+    return probs, min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parity and latency check of the detector backends")
+    parser.add_argument("--file", type=str, default="file/true1.csv", help="CSV file with the texts to score")
+    parser.add_argument("--limit", type=int, default=64, help="Number of texts to score")
+    parser.add_argument("--backends", type=str, nargs="+", default=BACKENDS, choices=BACKENDS, help="Backends to compare against torch")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of chunks per forward pass")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for ONNX Runtime")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed repetitions per backend (best is reported)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        raise FileNotFoundError(f"Il file {args.file} non esiste.")
+    texts = load_texts(args.file, args.limit)
+
+    reference, reference_time = run_backend(load_model("torch"), texts, args.batch_size, args.repeat)
+    reference_labels = reference.argmax(axis=1)
+
+    print(f"{'backend':<12} {'agreement':>10} {'max_diff':>10} {'ms/text':>10} {'speedup':>8}")
+    for backend in args.backends:
+        if backend == "torch":
+            probs, elapsed = reference, reference_time
+        else:
+            probs, elapsed = run_backend(load_model(backend, num_threads=args.threads), texts, args.batch_size, args.repeat)
+        agreement = float(np.mean(probs.argmax(axis=1) == reference_labels))
+        max_diff = float(np.abs(probs - reference).max())
+        print(f"{backend:<12} {agreement:>10.4f} {max_diff:>10.4f} {1000 * elapsed / len(texts):>10.1f} {reference_time / elapsed:>7.2f}x")
@@ -0,0 +1,36 @@
+import argparse
+import os
+import time
+from detector import explain_fake_text
+from benchmark_detector import load_texts
+
+# Costo contro fedelta' delle spiegazioni SHAP: per ogni max_evals confronta le parole
+# importanti con quelle di una spiegazione di riferimento calcolata con piu' valutazioni.
+
+
+def top_words(important_words):
+    return {word.strip().lower() for word, _ in important_words}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost versus fidelity of the SHAP explanations")
+    parser.add_argument("--file", type=str, default="file/true1.csv", help="CSV file with the texts to explain")
+    parser.add_argument("--limit", type=int, default=5, help="Number of texts to explain")
+    parser.add_argument("--reference-evals", type=int, default=2000, help="max_evals of the reference explanation")
+    parser.add_argument("--evals", type=int, nargs="+", default=[100, 250, 500, 1000], help="max_evals values to compare")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        raise FileNotFoundError(f"Il file {args.file} non esiste.")
+    texts = load_texts(args.file, args.limit)
+    references = [top_words(explain_fake_text(text, max_evals=args.reference_evals)[0]) for text in texts]
+
+    print(f"{'max_evals':>10} {'s/text':>8} {'overlap':>8}")
+    for max_evals in args.evals:
+        start = time.perf_counter()
+        overlaps = []
+        for text, reference in zip(texts, references):
+            words = top_words(explain_fake_text(text, max_evals=max_evals)[0])
+            overlaps.append(len(words & reference) / max(len(words | reference), 1))
+        elapsed = (time.perf_counter() - start) / len(texts)
+        print(f"{max_evals:>10} {elapsed:>8.2f} {sum(overlaps) / len(overlaps):>8.3f}")
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache condivise dalla pipeline: LRU in memoria e cache persistente su SQLite.
+
+
+def text_key(*parts):
+    """Hash sha256 di una sequenza di parti (testi, identita' del modello, parametri)."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class LRUCache:
+    """Cache in memoria con numero massimo di voci ed eviction della voce usata meno di recente."""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SizedLRUCache(LRUCache):
+    """
+    LRU limitata dalla dimensione totale delle voci (sizeof(valore), ad esempio in byte) invece
+    che dal loro numero. Una voce gia' presente va reinserita con set() se la sua dimensione cambia.
+    La voce appena inserita non viene mai rimossa, anche se da sola supera il limite.
+    """
+    def __init__(self, max_size, sizeof):
+        super().__init__(maxsize=None)
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self._sizes = {}
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self.size += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while self.size > self.max_size and len(self._data) > 1:
+                old_key, _ = self._data.popitem(last=False)
+                self.size -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.size = 0
+
+    def stats(self):
+        stats = super().stats()
+        stats["bytes"] = self.size
+        return stats
+
+
+class DiskCache:
+    """
+    Cache persistente su SQLite (chiave -> valore JSON) con limite sul numero di voci
+    (max_entries) e/o sui byte dei valori (max_bytes); None = nessun limite. Si elimina la
+    voce usata meno di recente. Le letture non fanno commit: l'ora di accesso dei hit viene
+    salvata con la scrittura successiva o dopo touch_batch hit.
+    """
+    def __init__(self, path, max_entries=100000, max_bytes=None, touch_batch=256):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._conn.commit()
+        self._size, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM cache"
+        ).fetchone()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._apply_touched()
+                self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def _apply_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE cache SET accessed = ? WHERE key = ?", [(at, key) for key, at in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def set(self, key, value):
+        data = json.dumps(value)
+        nbytes = len(data.encode("utf-8"))
+        with self._lock:
+            # gli accessi in sospeso vanno applicati prima dell'eviction, che sceglie per ora di accesso
+            self._apply_touched()
+            row = self._conn.execute("SELECT LENGTH(CAST(value AS BLOB)) FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO cache (key, value, accessed) VALUES (?, ?, ?)", (key, data, time.time())
+                )
+                self._size += 1
+                self._bytes += nbytes
+            else:
+                self._conn.execute(
+                    "UPDATE cache SET value = ?, accessed = ? WHERE key = ?", (data, time.time(), key)
+                )
+                self._bytes += nbytes - row[0]
+            self._evict()
+            self._conn.commit()
+
+    def _over_limit(self, size, nbytes):
+        return (self.max_entries is not None and size > self.max_entries) or (
+            self.max_bytes is not None and nbytes > self.max_bytes
+        )
+
+    def _evict(self):
+        if not self._over_limit(self._size, self._bytes):
+            return
+        victims = []
+        size, nbytes = self._size, self._bytes
+        for key, length in self._conn.execute("SELECT key, LENGTH(CAST(value AS BLOB)) FROM cache ORDER BY accessed"):
+            victims.append((key,))
+            size -= 1
+            nbytes -= length
+            if not self._over_limit(size, nbytes):
+                break
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+        self._size, self._bytes = size, nbytes
+        self.evictions += len(victims)
+
+    def __len__(self):
+        return self._size
+
+    def flush(self):
+        with self._lock:
+            self._apply_touched()
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._apply_touched()
+            self._conn.commit()
+            self._conn.close()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": self._size,
+            "bytes": self._bytes,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+
+# Lettura a blocchi del dataset degli articoli (file/true1.csv): nessun caricamento completo in memoria.
+# L'indice di un articolo e' la sua posizione tra le righe con titolo e testo, la stessa
+# che si otteneva con pd.read_csv(...)[['title', 'text']].dropna() seguito da df.iloc[i].
+
+CHUNKSIZE = 5000
+
+
+def iter_articles(file_path, start=0, end=None, shard=None, chunksize=CHUNKSIZE, delimiter=';'):
+    """
+    Genera (indice, titolo, testo) per gli articoli con start <= indice < end.
+    shard: (k, N) per tenere solo gli indici con indice % N == k.
+    La lettura si ferma appena superato end.
+    """
+    position = 0
+    reader = pd.read_csv(
+        file_path,
+        delimiter=delimiter,
+        usecols=["title", "text"],
+        dtype=str,
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            chunk = chunk.dropna()
+            first = position
+            position += len(chunk)
+            if position <= start:
+                continue
+
+            for offset, (title, text) in enumerate(zip(chunk["title"], chunk["text"])):
+                index = first + offset
+                if index < start:
+                    continue
+                if end is not None and index >= end:
+                    return
+                if shard and index % shard[1] != shard[0]:
+                    continue
+                yield index, title, text
+
+            if end is not None and position >= end:
+                return
+
+
+
+def metrics_path_for(output_path, metrics_dir):
+    """output.csv -> metric.csv, output_full.csv -> full_metric.csv, output_no_X.csv -> metric_no_X.csv"""
+    name = os.path.splitext(os.path.basename(output_path))[0]
+    if name == "output_full":
+        metric_name = "full_metric"
+    else:
+        metric_name = "metric" + name[len("output"):]
+    return os.path.join(metrics_dir, f"{metric_name}.csv")
+
+
+def is_scored_row(row):
+    """Riga di output per cui main.py ha scritto una riga di metriche."""
+    return not row.get("error") and bool(row["original_text"]) and bool(row["modified_text"])
+
+
+def output_row_indices(output_path, metrics_dir):
+    """
+    Indici degli articoli per le righe di un file di output senza colonna index (scritto prima
+    della sua introduzione). La posizione della riga non e' l'indice (gli articoli partono da
+    --start e le righe con errore non hanno metriche): gli indici vengono dal file di metriche
+    corrispondente, che ha una riga per ogni riga di output con metriche, nello stesso ordine.
+    Restituisce un indice per riga, None per le righe senza metriche; ValueError se il file di
+    metriche manca o non ha lo stesso numero di righe.
+    """
+    metrics_path = metrics_path_for(output_path, metrics_dir)
+    if not os.path.exists(metrics_path):
+        raise ValueError(f"{output_path} has no 'index' column and {metrics_path} does not exist: cannot recover the article indices")
+    metric_indices = pd.read_csv(metrics_path, dtype=str, keep_default_na=False, usecols=["index"])["index"].tolist()
+    rows = []
+    for chunk in pd.read_csv(output_path, chunksize=1024, dtype=str, keep_default_na=False):
+        rows.extend(is_scored_row(row) for _, row in chunk.iterrows())
+    scored = sum(rows)
+    if scored != len(metric_indices):
+        raise ValueError(
+            f"{output_path} has no 'index' column and {scored} scored rows, but {metrics_path} has {len(metric_indices)} rows: "
+            "cannot recover the article indices"
+        )
+    indices = iter(metric_indices)
+    return [next(indices) if row_scored else None for row_scored in rows]
@@ -1,12 +1,19 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import copy
 import numpy as np
+import os
+import queue
 import re
-import shap
+import threading
+import time
 import unicodedata
+from concurrent.futures import Future
 from transformers import BertTokenizer, BertModel
 from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from startup import load_timer
+from cache import LRUCache, DiskCache, text_key
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -35,65 +42,226 @@ class BertClassifier(nn.Module):
 TOKENIZER_PATH = "detector/berttokenizer1"
 MODEL_PATH = "detector/bertfakenews1_.pt"
 
-# 3. Caricamento
-tokenizer = BertTokenizer.from_pretrained(TOKENIZER_PATH)
-model = BertClassifier()
-model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
-model.to(device)
-model.eval()
+# 3. Caricamento (lazy: al primo utilizzo)
+_tokenizer = None
+_model = None
+_explainer = None
+_load_lock = threading.RLock()
+# l'explainer SHAP non e' thread-safe: una spiegazione alla volta
+_explain_lock = threading.Lock()
+
+def get_tokenizer():
+    global _tokenizer
+    with _load_lock:
+        if _tokenizer is None:
+            with load_timer("detector.tokenizer"):
+                _tokenizer = BertTokenizer.from_pretrained(TOKENIZER_PATH)
+    return _tokenizer
+
+def get_model():
+    global _model
+    with _load_lock:
+        if _model is None:
+            with load_timer("detector.model"):
+                model = BertClassifier()
+                model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
+                model.to(device)
+                model.eval()
+                _model = model
+    return _model
+
+def get_explainer():
+    global _explainer
+    with _load_lock:
+        if _explainer is None:
+            with load_timer("detector.shap_explainer"):
+                import shap
+                masker = shap.maskers.Text(get_tokenizer())
+                _explainer = shap.Explainer(shap_predictor, masker, output_names=["REAL", "FAKE"])
+    return _explainer
+
+# 3b. Backend alternativi per CPU (ONNX Runtime, quantizzazione int8)
+ONNX_PATH = "detector/bertfakenews1_.onnx"
+ONNX_INT8_PATH = "detector/bertfakenews1_.int8.onnx"
+BACKENDS = ["torch", "torch-int8", "onnx", "onnx-int8"]
+
+def export_onnx(model, onnx_path=ONNX_PATH, quantized_path=None, opset_version=14):
+    """Esporta BertClassifier (BERT + classificatore) in ONNX, opzionalmente anche in versione int8."""
+    model.eval()
+    dummy_ids = torch.ones(1, 16, dtype=torch.long)
+    dummy_mask = torch.ones(1, 16, dtype=torch.long)
+    torch.onnx.export(
+        model.cpu(),
+        (dummy_ids, dummy_mask),
+        onnx_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset_version,
+        dynamo=False,
+    )
+    model.to(device)
+
+    if quantized_path:
+        quantize_onnx(onnx_path, quantized_path)
+
+def quantize_onnx(onnx_path=ONNX_PATH, quantized_path=ONNX_INT8_PATH):
+    """Quantizzazione dinamica int8 dei pesi del modello ONNX."""
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError:
+        raise ImportError("La quantizzazione ONNX richiede onnxruntime: pip install onnxruntime")
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+
+class OnnxBertClassifier:
+    """Stessa interfaccia di BertClassifier (model(input_ids, attention_mask) -> logits) su ONNX Runtime."""
+    def __init__(self, onnx_path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("Il backend ONNX richiede onnxruntime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        logits = self.session.run(["logits"], {
+            "input_ids": input_ids.cpu().numpy().astype(np.int64),
+            "attention_mask": attention_mask.cpu().numpy().astype(np.int64),
+        })[0]
+        return torch.from_numpy(logits).to(device)
+
+def load_model(backend="torch", num_threads=None):
+    """Restituisce il classificatore per il backend scelto; i file ONNX vengono esportati al primo uso."""
+    model = get_model()
+    if backend == "torch":
+        return model
+    if backend == "torch-int8":
+        # quantizzazione dinamica dei Linear: solo CPU, anche gli input restano su CPU
+        quantized = torch.quantization.quantize_dynamic(copy.deepcopy(model).cpu(), {nn.Linear}, dtype=torch.qint8)
+        quantized.input_device = torch.device("cpu")
+        return quantized
+    if backend == "onnx":
+        if not os.path.exists(ONNX_PATH):
+            export_onnx(model, ONNX_PATH)
+        return OnnxBertClassifier(ONNX_PATH, num_threads=num_threads)
+    if backend == "onnx-int8":
+        if not os.path.exists(ONNX_INT8_PATH):
+            if os.path.exists(ONNX_PATH):
+                quantize_onnx(ONNX_PATH, ONNX_INT8_PATH)
+            else:
+                export_onnx(model, ONNX_PATH, quantized_path=ONNX_INT8_PATH)
+        return OnnxBertClassifier(ONNX_INT8_PATH, num_threads=num_threads)
+    raise ValueError(f"Backend non supportato: {backend}. Scegli tra {BACKENDS}")
 
 # 4. Preprocessing base
 def text_preprocessing(text):
     return re.sub(r"\s+", " ", text.strip())
 
+def normalize_text(text):
+    """Forma NFKD, la stessa passata al tokenizer: testi equivalenti danno gli stessi token."""
+    return unicodedata.normalize("NFKD", text)
+
 # 5. Predizione con chunking
-def bert_predict_with_chunking(model, texts, max_len=512):
-    model.eval()
-    all_probs = []
+def _chunk_token_ids(text, max_len=512):
+    tokenizer = get_tokenizer()
+    encoding = tokenizer.encode_plus(
+        text.strip(),
+        add_special_tokens=False,
+        return_attention_mask=False,
+        return_tensors=None
+    )
+    tokens = encoding["input_ids"]
+    return [
+        [tokenizer.cls_token_id] + tokens[i:i + max_len - 2] + [tokenizer.sep_token_id]
+        for i in range(0, len(tokens), max_len - 2)
+    ]
 
-    for text in texts:
+def bert_predict_with_chunking(model, texts, max_len=512, batch_size=32):
+    """
+    Predizione batch: i chunk di tutti i testi vengono ordinati per lunghezza,
+    raggruppati in micro-batch di batch_size e paddati solo fino al chunk piu' lungo
+    del micro-batch. Le softmax dei chunk vengono poi mediate per ogni testo.
+    """
+    model.eval()
+    tokenizer = get_tokenizer()
+    all_probs = np.full((len(texts), 2), 0.5)
+    # i modelli solo CPU (torch-int8) indicano il proprio device, gli altri usano quello globale
+    input_device = getattr(model, "input_device", device)
+
+    # raccolta dei chunk (indice testo, token) di tutti i testi
+    chunks = []
+    for idx, text in enumerate(texts):
         if not text.strip():
-            all_probs.append(np.array([0.5, 0.5]))
             continue
+        chunks.extend((idx, ids) for ids in _chunk_token_ids(text, max_len))
 
-        encoding = tokenizer.encode_plus(
-            text.strip(),
-            add_special_tokens=False,
-            return_attention_mask=False,
-            return_tensors=None
-        )
-        tokens = encoding["input_ids"]
-        chunks = [tokens[i:i + max_len - 2] for i in range(0, len(tokens), max_len - 2)]
+    if not chunks:
+        return all_probs
+
+    # bucket per lunghezza: ogni micro-batch contiene chunk di lunghezza simile
+    chunks.sort(key=lambda c: len(c[1]))
+    prob_sums = {}
+    counts = {}
 
-        input_ids, attn_masks = [], []
-        for chunk in chunks:
-            tokens_chunk = [tokenizer.cls_token_id] + chunk + [tokenizer.sep_token_id]
-            padding_length = max_len - len(tokens_chunk)
-            ids = tokens_chunk + [tokenizer.pad_token_id] * padding_length
-            mask = [1] * len(tokens_chunk) + [0] * padding_length
+    with torch.no_grad():
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            batch_len = max(len(ids) for _, ids in batch)
 
-            input_ids.append(ids)
-            attn_masks.append(mask)
+            input_ids = [ids + [tokenizer.pad_token_id] * (batch_len - len(ids)) for _, ids in batch]
+            attn_masks = [[1] * len(ids) + [0] * (batch_len - len(ids)) for _, ids in batch]
 
-        input_ids = torch.tensor(input_ids).to(device)
-        attn_masks = torch.tensor(attn_masks).to(device)
+            input_ids = torch.tensor(input_ids).to(input_device)
+            attn_masks = torch.tensor(attn_masks).to(input_device)
 
-        with torch.no_grad():
             logits = model(input_ids, attn_masks)
-            probs = F.softmax(logits, dim=1)  # softmax su ogni chunk
-            avg_probs = torch.mean(probs, dim=0).cpu().numpy()
+            probs = F.softmax(logits, dim=1).cpu().numpy()  # softmax su ogni chunk
 
-        all_probs.append(avg_probs)
+            for (idx, _), p in zip(batch, probs):
+                prob_sums[idx] = prob_sums.get(idx, 0.0) + p
+                counts[idx] = counts.get(idx, 0) + 1
 
-    return np.array(all_probs)
+    for idx, total in prob_sums.items():
+        all_probs[idx] = total / counts[idx]
+
+    return all_probs
 
 # 6. SHAP: predizione per SHAP
-def shap_predictor(texts):
-    texts = [unicodedata.normalize("NFKD", t) for t in texts]
-    return bert_predict_with_chunking(model, texts)
+SHAP_MAX_EVALS = 500
+SHAP_MIN_EVALS = 100
+SHAP_BATCH_SIZE = 64
 
-masker = shap.maskers.Text(tokenizer)
-explainer = shap.Explainer(shap_predictor, masker, output_names=["REAL", "FAKE"])
+# valutazioni e tempo cumulati del predictor, usati per stimare quante valutazioni entrano nel budget
+shap_stats = {"evals": 0, "seconds": 0.0, "explanations": 0}
+_shap_stats_lock = threading.Lock()
+
+def shap_predictor(texts):
+    start = time.perf_counter()
+    texts = [normalize_text(t) for t in texts]
+    probs = bert_predict_with_chunking(get_model(), texts, batch_size=SHAP_BATCH_SIZE)
+    with _shap_stats_lock:
+        shap_stats["evals"] += len(texts)
+        shap_stats["seconds"] += time.perf_counter() - start
+    return probs
+
+def shap_evals_for_budget(time_budget, max_evals=SHAP_MAX_EVALS):
+    """Limita max_evals al numero di valutazioni stimate nel budget di tempo (secondi)."""
+    with _shap_stats_lock:
+        evals, seconds = shap_stats["evals"], shap_stats["seconds"]
+    if not time_budget or seconds <= 0:
+        return max_evals
+    evals_per_second = evals / seconds
+    return max(SHAP_MIN_EVALS, min(max_evals, int(time_budget * evals_per_second)))
 
 # 7. Validazione token per SHAP
 def is_valid_token(token):
@@ -106,11 +274,12 @@ def is_valid_token(token):
     )
 
 # 8. Estrazione parole importanti
-def extract_important_words(shap_values, text):
+def extract_important_words(shap_values, text, pred_class=None):
     values = shap_values[0].values
     tokens = shap_values[0].data
-    probs = shap_predictor([text])
-    pred_class = probs[0].argmax()
+    if pred_class is None:
+        probs = shap_predictor([text])
+        pred_class = probs[0].argmax()
 
     important_words = [
         (token, shap_val)
@@ -151,31 +320,184 @@ def extract_key_phrases(shap_values, threshold=0.001):
     return key_phrases[:3]
 
 
-def explain_fake_text(text):
-    shap_values = explainer([text])
-    important_words = extract_important_words(shap_values, text)
+def explain_fake_text(text, max_evals=SHAP_MAX_EVALS, time_budget=None, batch_size=SHAP_BATCH_SIZE):
+    """
+    max_evals / time_budget: limite sul numero di valutazioni del modello (fedelta' contro costo).
+    La classe spiegata e' quella predetta dal modello dell'explainer (torch), ricavata dai valori
+    SHAP stessi (base + somma dei contributi), non dalla predizione di un altro backend o della cache.
+    """
+    explainer = get_explainer()
+    with _explain_lock:
+        evals = shap_evals_for_budget(time_budget, max_evals)
+        with _shap_stats_lock:
+            evals_before = shap_stats["evals"]
+        start = time.perf_counter()
+
+        shap_values = explainer([text], max_evals=evals, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        with _shap_stats_lock:
+            used_evals = shap_stats["evals"] - evals_before
+            shap_stats["explanations"] += 1
+
+    explained = shap_values[0]
+    pred_class = int(np.argmax(explained.base_values + explained.values.sum(axis=0)))
+    important_words = extract_important_words(shap_values, text, pred_class=pred_class)
     key_phrases = extract_key_phrases(shap_values)
+
+    print(f"[SHAP] max_evals={evals} evals={used_evals} time={elapsed:.2f}s ({used_evals / max(elapsed, 1e-9):.1f} evals/s)")
     return important_words, key_phrases
 
 
+def format_label_score(label, probs):
+    real_score = round(float(probs[0]), 4)
+    fake_score = round(float(probs[1]), 4)
+    return f"{label} (Fake: {fake_score}, Real: {real_score})"
+
+
+class PredictionQueue:
+    """
+    Coda condivisa tra piu' articoli in esecuzione: i testi inviati con submit()
+    vengono raccolti fino a max_batch (o per al massimo max_wait secondi)
+    e valutati insieme con una sola chiamata a predict_batch.
+    """
+    def __init__(self, detector, max_batch=32, max_wait=0.05):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="PredictionQueue", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            texts = [text for text, _ in batch]
+            try:
+                results = self.detector._predict_batch_now(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+            if stop:
+                return
+
+
+def model_identity(backend="torch"):
+    """Identita' del checkpoint usata nelle chiavi di cache: percorso, dimensione e mtime del .pt piu' il backend."""
+    try:
+        st = os.stat(MODEL_PATH)
+        return f"{MODEL_PATH}:{st.st_size}:{int(st.st_mtime)}:{backend}"
+    except OSError:
+        return f"{MODEL_PATH}:{backend}"
+
+
+class PredictionCache:
+    """
+    Cache delle probabilita' del detector: LRU in memoria piu' cache opzionale su disco.
+    La chiave e' l'hash del testo normalizzato e dell'identita' del modello.
+    """
+    def __init__(self, identity, maxsize=4096, disk_path=None, max_disk_entries=200000):
+        self.identity = identity
+        self.memory = LRUCache(maxsize=maxsize)
+        self.disk = DiskCache(disk_path, max_entries=max_disk_entries) if disk_path else None
+
+    def key(self, text):
+        return text_key(self.identity, text_preprocessing(normalize_text(text)))
+
+    def get(self, text):
+        key = self.key(text)
+        probs = self.memory.get(key)
+        if probs is None and self.disk is not None:
+            probs = self.disk.get(key)
+            if probs is not None:
+                probs = np.array(probs)
+                self.memory.set(key, probs)
+        return probs
+
+    def set(self, text, probs):
+        key = self.key(text)
+        self.memory.set(key, probs)
+        if self.disk is not None:
+            self.disk.set(key, [float(p) for p in probs])
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self):
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
 class FakeNewsDetector:
-    def __init__(self, method="bert", model=None, tokenizer=None, llm_agent=None):
+    def __init__(self, method="bert", model=None, tokenizer=None, llm_agent=None, batch_size=32, backend="torch", cache=None):
         self.method = method
-        self.model = model
+        self.cache = cache
+        self._model = model
         self.tokenizer = tokenizer
+        self.backend = backend
         self.llm_agent = llm_agent
+        self.batch_size = batch_size
+        self.queue = None
 
-        if self.method == "bert" and (self.model is None or self.tokenizer is None):
-            raise ValueError("Per il metodo BERT servono model e tokenizer")
         if self.method == "llm" and self.llm_agent is None:
             raise ValueError("Per il metodo LLM serve un agente")
 
+    @property
+    def model(self):
+        # senza un model esplicito il backend viene caricato al primo utilizzo
+        if self._model is None and self.method == "bert":
+            self._model = load_model(self.backend)
+        return self._model
+
+    def start_queue(self, max_batch=32, max_wait=0.05):
+        """Attiva la modalita' a coda: predict() da piu' thread viene valutato in batch comuni."""
+        if self.method == "bert" and self.queue is None:
+            self.queue = PredictionQueue(self, max_batch=max_batch, max_wait=max_wait)
+        return self.queue
+
+    def stop_queue(self):
+        if self.queue is not None:
+            self.queue.close()
+            self.queue = None
+
     def predict(self, text):
         if self.method == "bert":
-            from detector import bert_predict_with_chunking
-            probs = bert_predict_with_chunking(self.model, [text])[0]
-            label = "Real" if probs[0] > probs[1] else "Fake"
-            return label, probs
+            if self.queue is not None:
+                return self.queue.submit(text).result()
+            return self._predict_batch_now([text])[0]
 
         elif self.method == "llm":
             message = f"Is this article real or fake? Answer only with 'Real' or 'Fake'.\n\n{text}"
@@ -183,3 +505,27 @@ class FakeNewsDetector:
             label = "Fake" if "fake" in response.summary.lower() else "Real"
             probs = [0.1, 0.9] if label == "Fake" else [0.9, 0.1]
             return label, probs
+
+    def predict_batch(self, texts):
+        """Restituisce una lista di (label, probs), una per ogni testo, nello stesso ordine."""
+        texts = list(texts)
+        if self.method == "bert":
+            if self.queue is not None:
+                futures = [self.queue.submit(text) for text in texts]
+                return [future.result() for future in futures]
+            return self._predict_batch_now(texts)
+        return [self.predict(text) for text in texts]
+
+    def _predict_batch_now(self, texts):
+        texts = [normalize_text(text) for text in texts]
+        if self.cache is None:
+            all_probs = bert_predict_with_chunking(self.model, texts, batch_size=self.batch_size)
+        else:
+            all_probs = [self.cache.get(text) for text in texts]
+            missing = list(dict.fromkeys(text for text, probs in zip(texts, all_probs) if probs is None))
+            if missing:
+                computed = dict(zip(missing, bert_predict_with_chunking(self.model, missing, batch_size=self.batch_size)))
+                for text, probs in computed.items():
+                    self.cache.set(text, probs)
+                all_probs = [computed[text] if probs is None else probs for text, probs in zip(texts, all_probs)]
+        return [("Real" if probs[0] > probs[1] else "Fake", probs) for probs in all_probs]
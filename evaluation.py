@@ -1,26 +1,291 @@
+import copy
 import json
-from nltk.translate.bleu_score import sentence_bleu
+import math
+import os
+import tempfile
+import threading
+from collections import Counter, defaultdict
+# Fraction di nltk accetta _normalize=False anche con Python >= 3.12 (fractions.Fraction no)
+from nltk.translate.bleu_score import brevity_penalty, SmoothingFunction, Fraction
+from nltk.util import ngrams
 from rouge_score import rouge_scorer
 import textstat
-from bert_score import score  
+from startup import load_timer
+from cache import LRUCache, SizedLRUCache, text_key
+
+_bert_scorer = None
+_rouge_scorer = None
+_load_lock = threading.Lock()
+
+# memoization delle metriche per coppia (originale, modificato)
+METRICS_CACHE_SIZE = 1024
+_metrics_cache = LRUCache(maxsize=METRICS_CACHE_SIZE)
+
+# riferimenti preparati (testi originali), riusati tra round e modalita' di ablazione; il limite
+# e' in byte perche' gli embedding BERTScore di un articolo occupano alcuni MB
+REFERENCE_CACHE_BYTES = 256 * 1024 * 1024
+# stima dei byte in memoria di un n-gram contato (tupla di token piu' voce del Counter)
+NGRAM_BYTES = 120
+_reference_cache = SizedLRUCache(REFERENCE_CACHE_BYTES, sizeof=lambda reference: reference.nbytes())
+
+BLEU_WEIGHTS = (0.25, 0.25, 0.25, 0.25)
+
+def metrics_cache_stats():
+    return _metrics_cache.stats()
+
+def get_bert_scorer():
+    """BERTScorer condiviso dal processo, creato al primo utilizzo (porta con se' torch e transformers)."""
+    global _bert_scorer
+    with _load_lock:
+        if _bert_scorer is None:
+            with load_timer("evaluation.bert_scorer"):
+                from bert_score import BERTScorer
+                _bert_scorer = BERTScorer(lang="en")
+    return _bert_scorer
+
+def get_rouge_scorer():
+    global _rouge_scorer
+    if _rouge_scorer is None:
+        _rouge_scorer = rouge_scorer.RougeScorer(["rouge1", "rouge2", "rougeL"], use_stemmer=True)
+    return _rouge_scorer
+
+
+class PreparedReference:
+    """
+    Testo originale di un articolo con gli artefatti riusati per ogni testo candidato:
+    token e n-gram per BLEU, token stemmati e n-gram per ROUGE, embedding BERTScore.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.key = text_key(text)
+
+        self.bleu_tokens = text.split()
+        self.bleu_ngrams = [Counter(ngrams(self.bleu_tokens, n)) for n in range(1, len(BLEU_WEIGHTS) + 1)]
+
+        self.rouge_tokens = get_rouge_scorer()._tokenizer.tokenize(text)
+        self.rouge_ngrams = {n: rouge_scorer._create_ngrams(self.rouge_tokens, n) for n in (1, 2)}
+
+        # (embedding, idf) del testo per il modello BERTScore indicato, calcolati al primo utilizzo
+        self.bert_model = None
+        self.bert_stats = None
+
+    def nbytes(self):
+        """Stima della memoria occupata: embedding e idf BERTScore piu' n-gram e token."""
+        size = len(self.text) + NGRAM_BYTES * (
+            sum(len(counts) for counts in self.bleu_ngrams)
+            + sum(len(grams) for grams in self.rouge_ngrams.values())
+            + len(self.bleu_tokens) + len(self.rouge_tokens)
+        )
+        if self.bert_stats is not None:
+            size += sum(t.element_size() * t.nelement() for t in self.bert_stats)
+        return size
+
+    def save(self, path):
+        # solo testo, nome del modello e tensori: il file si carica con weights_only=True,
+        # token e n-gram vengono ricalcolati dal testo
+        # scrittura su un file temporaneo nella stessa cartella e os.replace: un'interruzione
+        # non lascia mai un <hash>.pt troncato
+        import torch
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            torch.save({"text": self.text, "bert_model": self.bert_model, "bert_stats": self.bert_stats}, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        import torch
+        data = torch.load(path, weights_only=True)
+        reference = cls(data["text"])
+        reference.bert_model = data["bert_model"]
+        reference.bert_stats = tuple(data["bert_stats"]) if data["bert_stats"] is not None else None
+        return reference
+
+
+def prepare_reference(text, cache_dir=None):
+    """
+    Restituisce il PreparedReference del testo: dalla cache in memoria, dal file
+    cache_dir/<hash>.pt se presente, altrimenti lo costruisce (e lo salva in cache_dir).
+    """
+    key = text_key(text)
+    reference = _reference_cache.get(key)
+    if reference is not None:
+        return reference
+
+    path = os.path.join(cache_dir, f"{key}.pt") if cache_dir else None
+    if path and os.path.exists(path):
+        try:
+            reference = PreparedReference.load(path)
+        except Exception as e:
+            # file nel formato precedente (pickle completo), troncato o illeggibile: viene ricostruito
+            print(f"[CACHE] Rebuilding reference cache file {path}: {e!r}")
+            reference = None
+    if reference is None:
+        reference = PreparedReference(text)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            _bert_reference_stats([reference], batch_size=1)
+            reference.save(path)
+
+    _reference_cache.set(key, reference)
+    return reference
+
+
+def _bleu(reference, hypothesis):
+    # stesso calcolo di nltk sentence_bleu (pesi uniformi, nessuno smoothing) con gli n-gram del riferimento gia' contati
+    p_n = []
+    for n, reference_counts in enumerate(reference.bleu_ngrams, start=1):
+        counts = Counter(ngrams(hypothesis, n)) if len(hypothesis) >= n else Counter()
+        clipped = sum(min(count, reference_counts[ngram]) for ngram, count in counts.items())
+        p_n.append(Fraction(clipped, max(1, sum(counts.values())), _normalize=False))
+
+    if p_n[0].numerator == 0:
+        return 0
+
+    bp = brevity_penalty(len(reference.bleu_tokens), len(hypothesis))
+    p_n = SmoothingFunction().method0(p_n)
+    s = (w_i * math.log(p_i) for w_i, p_i in zip(BLEU_WEIGHTS, p_n) if p_i > 0)
+    return bp * math.exp(math.fsum(s))
+
+
+def _rouge(reference, modified_text):
+    prediction_tokens = get_rouge_scorer()._tokenizer.tokenize(modified_text)
+    return {
+        "rouge1": rouge_scorer._score_ngrams(reference.rouge_ngrams[1], rouge_scorer._create_ngrams(prediction_tokens, 1)),
+        "rouge2": rouge_scorer._score_ngrams(reference.rouge_ngrams[2], rouge_scorer._create_ngrams(prediction_tokens, 2)),
+        "rougeL": rouge_scorer._score_lcs(reference.rouge_tokens, prediction_tokens),
+    }
+
+
+def _bert_sentence_stats(sentences, batch_size):
+    """(embedding, idf) per frase, calcolati come in bert_score.bert_cos_score_idf."""
+    from bert_score.utils import get_bert_embedding
+
+    scorer = get_bert_scorer()
+    idf_dict = defaultdict(lambda: 1.0)
+    idf_dict[scorer._tokenizer.sep_token_id] = 0
+    idf_dict[scorer._tokenizer.cls_token_id] = 0
+
+    stats = {}
+    sentences = sorted(set(sentences), key=lambda x: len(x.split(" ")), reverse=True)
+    for start in range(0, len(sentences), batch_size):
+        batch = sentences[start:start + batch_size]
+        embs, masks, padded_idf = get_bert_embedding(
+            batch, scorer._model, scorer._tokenizer, idf_dict, device=scorer.device, all_layers=scorer.all_layers
+        )
+        embs, masks, padded_idf = embs.cpu(), masks.cpu(), padded_idf.cpu()
+        for i, sentence in enumerate(batch):
+            length = masks[i].sum().item()
+            # copie: una vista terrebbe in memoria (e nei file di cache) l'intero batch
+            stats[sentence] = (embs[i, :length].clone(), padded_idf[i, :length].clone())
+    return stats
+
+
+def _bert_reference_stats(references, batch_size):
+    model_type = get_bert_scorer().model_type
+    missing = [r for r in references if r.bert_stats is None or r.bert_model != model_type]
+    if missing:
+        stats = _bert_sentence_stats([r.text for r in missing], batch_size)
+        for reference in missing:
+            reference.bert_stats = stats[reference.text]
+            reference.bert_model = model_type
+            if reference.key in _reference_cache:
+                # la dimensione e' cambiata: la voce viene ricontata
+                _reference_cache.set(reference.key, reference)
+
+
+def _bert_f1(reference_stats, candidate_stats, batch_size):
+    import torch
+    from torch.nn.utils.rnn import pad_sequence
+    from bert_score.utils import greedy_cos_idf
+
+    scorer = get_bert_scorer()
+
+    def pad_batch_stats(stats):
+        emb = [e.to(scorer.device) for e, _ in stats]
+        idf = [i.to(scorer.device) for _, i in stats]
+        lens = torch.tensor([e.size(0) for e in emb], dtype=torch.long)
+        emb_pad = pad_sequence(emb, batch_first=True, padding_value=2.0)
+        idf_pad = pad_sequence(idf, batch_first=True)
+        pad_mask = (torch.arange(int(lens.max())).expand(len(lens), -1) < lens.unsqueeze(1)).to(scorer.device)
+        return emb_pad, pad_mask, idf_pad
+
+    f1 = []
+    with torch.no_grad():
+        for start in range(0, len(reference_stats), batch_size):
+            P, R, F1 = greedy_cos_idf(
+                *pad_batch_stats(reference_stats[start:start + batch_size]),
+                *pad_batch_stats(candidate_stats[start:start + batch_size]),
+                scorer.all_layers
+            )
+            f1.extend(F1.cpu().tolist())
+    return f1
+
+
+def _reference_key(original):
+    return original.key if isinstance(original, PreparedReference) else text_key(original)
+
+
+def calculate_metrics_batch(pairs, batch_size=64):
+    """
+    Calcola le metriche NLP per una lista di coppie (testo originale, testo modificato).
+    Il testo originale puo' essere un PreparedReference: in quel caso vengono elaborati solo i candidati.
+    Le coppie gia' calcolate vengono prese dalla cache; per le altre BERTScore viene
+    calcolato insieme, in batch da batch_size frasi.
+    """
+    pairs = list(pairs)
+    keys = [text_key(_reference_key(original), modified_text) for original, modified_text in pairs]
+
+    results = {}
+    missing = []
+    for key, pair in zip(keys, pairs):
+        if key in results:
+            continue
+        results[key] = _metrics_cache.get(key)
+        if results[key] is None:
+            missing.append((key, pair))
+
+    if missing:
+        for (key, _), metrics in zip(missing, _score_pairs([pair for _, pair in missing], batch_size)):
+            _metrics_cache.set(key, metrics)
+            results[key] = metrics
+
+    return [copy.deepcopy(results[key]) for key in keys]
+
+def _score_pairs(pairs, batch_size):
+    if not pairs:
+        return []
+
+    references = [
+        original if isinstance(original, PreparedReference) else prepare_reference(original)
+        for original, _ in pairs
+    ]
+    modified_texts = [modified_text for _, modified_text in pairs]
+    bert_scores = bert_score_batch(list(zip(references, modified_texts)), batch_size)
+
+    results = []
+    for reference, modified_text, bert_score_f1 in zip(references, modified_texts, bert_scores):
+        metrics = lexical_metrics(reference, modified_text)
+        metrics["bert_score"] = bert_score_f1
+        results.append(metrics)
+    return results
+
+def lexical_metrics(original, modified_text):
+    """BLEU, ROUGE e readability (senza BERTScore): solo CPU, adatto a un pool di processi."""
+    reference = original if isinstance(original, PreparedReference) else PreparedReference(original)
 
-def calculate_metrics(original_text, modified_text):
-    """Calcola metriche NLP tra il testo originale e il testo modificato."""
-    
     #calcolo BLEU score
-    bleu_score = sentence_bleu([original_text.split()], modified_text.split())
+    bleu_score = _bleu(reference, modified_text.split())
 
     # Calcolo ROUGE score
-    scorer = rouge_scorer.RougeScorer(["rouge1", "rouge2", "rougeL"], use_stemmer=True)
-    rouge_scores = scorer.score(original_text, modified_text)
+    rouge_scores = _rouge(reference, modified_text)
 
     #calcolo Readability score (Flesch-Kincaid)
     readability_score = textstat.flesch_reading_ease(modified_text)
 
-    #calcolo BERTScore (F1-score medio tra le embeddings dei testi)
-    P, R, F1 = score([modified_text], [original_text], lang="en")  
-    bert_score_f1 = F1.mean().item()  
-
     return {
         "bleu": bleu_score,
         "rouge": {
@@ -29,5 +294,29 @@ def calculate_metrics(original_text, modified_text):
             "rougeL": rouge_scores["rougeL"].fmeasure,
         },
         "readability": readability_score,
-        "bert_score": bert_score_f1
     }
+
+def bert_score_batch(pairs, batch_size=64):
+    """
+    BERTScore F1 per una lista di coppie (originale, modificato), in batch da batch_size frasi.
+    Per gli originali PreparedReference l'embedding del riferimento viene riusato.
+    """
+    if not pairs:
+        return []
+    prepared = [original for original, _ in pairs if isinstance(original, PreparedReference)]
+    _bert_reference_stats(prepared, batch_size)
+
+    #calcolo BERTScore (F1-score medio tra le embeddings dei testi)
+    sentences = [modified_text for _, modified_text in pairs]
+    sentences += [original for original, _ in pairs if not isinstance(original, PreparedReference)]
+    stats = _bert_sentence_stats(sentences, batch_size)
+
+    return _bert_f1(
+        [original.bert_stats if isinstance(original, PreparedReference) else stats[original] for original, _ in pairs],
+        [stats[modified_text] for _, modified_text in pairs],
+        batch_size
+    )
+
+def calculate_metrics(original_text, modified_text):
+    """Calcola metriche NLP tra il testo originale (str o PreparedReference) e il testo modificato."""
+    return calculate_metrics_batch([(original_text, modified_text)])[0]
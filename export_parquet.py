@@ -0,0 +1,152 @@
+import argparse
+import glob
+import os
+import re
+import pandas as pd
+from dataset import output_row_indices
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    raise ImportError("L'export Parquet richiede pyarrow: pip install pyarrow")
+
+# Esporta output_files/output*.csv e metrics/*.csv in Parquet con colonne tipizzate:
+# le etichette "Fake (Fake: 0.9, Real: 0.1)" diventano label + probabilita' float,
+# le metriche float64. Un row group per blocco di righe letto dal CSV; chi legge puo'
+# caricare solo le colonne che servono, con il file mappato in memoria (read_columns).
+
+LABEL_SCORE = re.compile(r"^\s*(\w+)\s*\(Fake:\s*([-+\d.eE]+),\s*Real:\s*([-+\d.eE]+)\)\s*$")
+
+METRIC_COLUMNS = [
+    "initial_bleu", "initial_rouge1", "initial_rouge2", "initial_rougeL", "initial_readability", "initial_bert_score",
+    "final_bleu", "final_rouge1", "final_rouge2", "final_rougeL", "final_readability", "final_bert_score"
+]
+TEXT_COLUMNS = ["original_title", "original_text", "modified_text_1", "modified_title", "modified_text", "error"]
+LABEL_COLUMNS = {"initial_label_score": "initial", "final_label_score": "final"}
+
+OUTPUT_SCHEMA = pa.schema(
+    [("variant", pa.dictionary(pa.int8(), pa.string())), ("index", pa.int64())]
+    + [(column, pa.large_string()) for column in TEXT_COLUMNS]
+    + [
+        field
+        for prefix in LABEL_COLUMNS.values()
+        for field in (
+            (f"{prefix}_label", pa.dictionary(pa.int8(), pa.string())),
+            (f"{prefix}_fake", pa.float64()),
+            (f"{prefix}_real", pa.float64()),
+        )
+    ]
+)
+METRIC_SCHEMA = pa.schema(
+    [("variant", pa.dictionary(pa.int8(), pa.string())), ("index", pa.int64())]
+    + [(column, pa.float64()) for column in METRIC_COLUMNS]
+)
+
+
+def variant_name(path):
+    """Nome della variante dal nome del file: output.csv / metric.csv -> all_agents, *_full -> full, *_no_X -> no_X."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name in ("output_full", "full_metric"):
+        return "full"
+    for prefix in ("output_", "metric_"):
+        if name.startswith(prefix + "no_"):
+            return name[len(prefix):]
+    return "all_agents"
+
+
+def parse_label_score(value):
+    """'Fake (Fake: 0.9, Real: 0.1)' -> ('Fake', 0.9, 0.1); (None, None, None) se vuoto o non riconosciuto."""
+    match = LABEL_SCORE.match(str(value))
+    if not match:
+        return None, None, None
+    return match.group(1), float(match.group(2)), float(match.group(3))
+
+
+def _index_column(chunk, indices):
+    if "index" in chunk.columns:
+        return pd.to_numeric(chunk["index"], errors="coerce").astype("Int64")
+    # file scritti prima dell'introduzione della colonna index: indici dal file di metriche (vedi export_file)
+    if indices is None:
+        raise ValueError("the file has no 'index' column")
+    return pd.to_numeric(pd.Series(indices, dtype=object), errors="coerce").astype("Int64")
+
+
+def output_table(chunk, variant, indices=None):
+    chunk = chunk.reset_index(drop=True)
+    data = {"variant": [variant] * len(chunk), "index": _index_column(chunk, indices)}
+    for column in TEXT_COLUMNS:
+        data[column] = chunk[column] if column in chunk.columns else [""] * len(chunk)
+    for column, prefix in LABEL_COLUMNS.items():
+        parsed = [parse_label_score(value) for value in chunk.get(column, [""] * len(chunk))]
+        data[f"{prefix}_label"] = [label for label, _, _ in parsed]
+        data[f"{prefix}_fake"] = [fake for _, fake, _ in parsed]
+        data[f"{prefix}_real"] = [real for _, _, real in parsed]
+    frame = pd.DataFrame(data).reset_index(drop=True)
+    return pa.Table.from_pandas(frame, schema=OUTPUT_SCHEMA, preserve_index=False)
+
+
+def metric_table(chunk, variant, indices=None):
+    chunk = chunk.reset_index(drop=True)
+    data = {"variant": [variant] * len(chunk), "index": _index_column(chunk, indices)}
+    for column in METRIC_COLUMNS:
+        values = chunk[column] if column in chunk.columns else [None] * len(chunk)
+        data[column] = pd.to_numeric(pd.Series(values), errors="coerce").astype("float64")
+    frame = pd.DataFrame(data).reset_index(drop=True)
+    return pa.Table.from_pandas(frame, schema=METRIC_SCHEMA, preserve_index=False)
+
+
+def export_file(input_path, output_path, to_table, schema, chunksize=1024, compression="zstd", metrics_dir=None):
+    """
+    Converte un CSV in Parquet a blocchi di chunksize righe (un row group per blocco).
+    Un file di output senza colonna index prende gli indici dal file di metriche in metrics_dir
+    (nulli per le righe con errore); senza metrics_dir, o per un file di metriche, ValueError.
+    """
+    indices = None
+    if "index" not in pd.read_csv(input_path, nrows=0).columns:
+        if to_table is not output_table or metrics_dir is None:
+            raise ValueError(f"{input_path} has no 'index' column: cannot recover the article indices")
+        indices = output_row_indices(input_path, metrics_dir)
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    variant = variant_name(input_path)
+    rows = 0
+    tmp_path = output_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema, compression=compression) as writer:
+        for chunk in pd.read_csv(input_path, chunksize=chunksize, dtype=str, keep_default_na=False):
+            chunk_indices = indices[rows:rows + len(chunk)] if indices is not None else None
+            writer.write_table(to_table(chunk, variant, indices=chunk_indices))
+            rows += len(chunk)
+    os.replace(tmp_path, output_path)
+    return rows
+
+
+def read_columns(path, columns=None, filters=None):
+    """Legge solo le colonne indicate (tutte se None), con il file mappato in memoria; filters come in pyarrow."""
+    return pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the output and metrics CSV files to Parquet with typed columns")
+    parser.add_argument("--outputs", type=str, default="output_files/output*.csv", help="Glob of the output CSV files")
+    parser.add_argument("--metrics", type=str, default="metrics/*.csv", help="Glob of the metrics CSV files")
+    parser.add_argument("--output-dir", type=str, default="parquet", help="Directory for the Parquet files (outputs/ and metrics/)")
+    parser.add_argument("--chunksize", type=int, default=1024, help="CSV rows read at a time (one Parquet row group each)")
+    parser.add_argument("--compression", type=str, default="zstd", help="Parquet compression codec (zstd, snappy, gzip, none)")
+    parser.add_argument("--metrics-dir", type=str, default="metrics", help="Original metrics files, used for the article indices of output files without an 'index' column")
+    args = parser.parse_args()
+
+    jobs = [(path, "outputs", output_table, OUTPUT_SCHEMA) for path in sorted(glob.glob(args.outputs))]
+    jobs += [(path, "metrics", metric_table, METRIC_SCHEMA) for path in sorted(glob.glob(args.metrics))]
+    for input_path, subdir, to_table, schema in jobs:
+        name = os.path.splitext(os.path.basename(input_path))[0] + ".parquet"
+        output_path = os.path.join(args.output_dir, subdir, name)
+        try:
+            rows = export_file(
+                input_path, output_path, to_table, schema,
+                chunksize=args.chunksize, compression=args.compression, metrics_dir=args.metrics_dir
+            )
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"[PARQUET] {input_path} -> {output_path} ({rows} rows)")
@@ -0,0 +1,661 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import json
+import threading
+import time
+import autogen
+import httpx
+import openai
+from openai import AsyncOpenAI
+from cache import DiskCache, text_key
+
+# pool di connessioni HTTP condiviso da tutte le chiamate agli LLM (keep-alive tra una chiamata e l'altra)
+POOL_LIMITS = dict(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+# timeout (secondi) della singola richiesta, se la config dell'endpoint non indica "timeout"
+DEFAULT_TIMEOUT = 120.0
+CONNECT_TIMEOUT = 10.0
+MAX_RETRIES = 2
+
+# endpoint multipli: errori consecutivi prima di togliere un endpoint dalla rotazione,
+# intervallo (secondi) e timeout del controllo periodico di salute
+MAX_FAILURES = 2
+HEALTH_INTERVAL = 30.0
+HEALTH_TIMEOUT = 5.0
+
+# limite adattivo (AIMD) delle richieste in corso per endpoint; "max_concurrency" nella config
+# dell'endpoint sostituisce LIMIT_MAX. Una richiesta e' "lenta" quando la sua latenza per unita'
+# di lavoro (token generati + PROMPT_TOKEN_WEIGHT per token di prompt) supera LATENCY_TOLERANCE
+# volte quella di riferimento delle richieste di dimensione simile.
+LIMIT_INITIAL = 4
+LIMIT_MIN = 1
+LIMIT_MAX = 32
+LIMIT_BACKOFF = 0.7
+ERROR_BACKOFF = 0.5
+LATENCY_TOLERANCE = 1.5
+BASELINE_DRIFT = 0.01
+PROMPT_TOKEN_WEIGHT = 0.1
+
+# dimensione massima (byte delle risposte) della cache persistente delle risposte
+RESPONSE_CACHE_BYTES = 512 * 1024 * 1024
+
+# contesto delle conversazioni (vedi ContextBudget): stima dei token dai caratteri e costo fisso per messaggio
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKENS = 4
+
+# parametri di generazione letti da llm_config (o dalla config dell'endpoint) e passati alla richiesta
+SAMPLING_KEYS = ("temperature", "top_p", "max_tokens", "seed", "stop", "frequency_penalty", "presence_penalty")
+
+_lock = threading.Lock()
+_loop = None
+_clients = {}
+_pools = {}
+_response_cache = None
+# ReplyMemo attivo per la chat corrente (vedi memo_scope)
+_reply_memo = contextvars.ContextVar("reply_memo", default=None)
+# ContextBudget attivo per la chat corrente (vedi context_scope)
+_context_budget = contextvars.ContextVar("context_budget", default=None)
+# False nelle chat che continuano una conversazione (i tentativi di correzione): niente memo ne' cache
+_reuse_replies = contextvars.ContextVar("reuse_replies", default=True)
+_context_totals = collections.Counter()
+
+
+def get_loop():
+    """Event loop condiviso, in un thread dedicato, su cui girano tutte le chiamate agli LLM."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-client", daemon=True).start()
+    return _loop
+
+
+def get_client(config):
+    """AsyncOpenAI per l'endpoint della config, creato una volta sola e riusato (un pool di connessioni per endpoint)."""
+    key = (config.get("base_url"), config.get("api_key"))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            timeout = config.get("timeout") or DEFAULT_TIMEOUT
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(**POOL_LIMITS),
+                timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+            )
+            client = AsyncOpenAI(
+                base_url=config.get("base_url"),
+                api_key=config.get("api_key") or "none",
+                http_client=http_client,
+                max_retries=config.get("max_retries", MAX_RETRIES),
+            )
+            _clients[key] = client
+    return client
+
+
+class AdaptiveLimiter:
+    """
+    Limite AIMD sulle richieste in corso: +1 ogni `limit` risposte con latenza stabile,
+    x LIMIT_BACKOFF quando la latenza sale, x ERROR_BACKOFF sugli errori. Le richieste oltre
+    il limite attendono in coda (FIFO). Usato solo dal loop condiviso, quindi senza lock.
+    """
+    def __init__(self, initial=LIMIT_INITIAL, min_limit=LIMIT_MIN, max_limit=LIMIT_MAX, tolerance=LATENCY_TOLERANCE):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.baselines = {}         # latenza per unita' di lavoro di riferimento, per dimensione della richiesta
+        self.last_decrease = 0.0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self._waiters = collections.deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        """Attende un posto libero; restituisce l'istante in cui la richiesta puo' partire."""
+        start = time.perf_counter()
+        if self._waiters or self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # il posto era gia' stato assegnato: lo si restituisce
+                    self.in_flight -= 1
+                    self._wake()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        else:
+            self.in_flight += 1
+
+        now = time.perf_counter()
+        self.waits += 1
+        self.wait_time += now - start
+        self.max_wait = max(self.max_wait, now - start)
+        return now
+
+    def release(self, start, latency=None, tokens=None, error=False, prompt_tokens=None):
+        """Libera il posto e aggiorna il limite con l'esito della richiesta partita in start."""
+        self.in_flight -= 1
+        if error:
+            self._decrease(start, ERROR_BACKOFF)
+        elif latency is not None:
+            # le risposte brevi dopo un prompt lungo costano soprattutto la lettura del prompt: la latenza
+            # si divide per il lavoro totale e si confronta con richieste della stessa dimensione
+            # (potenza di 2 dei token di prompt e generati), non con le riscritture lunghe
+            completion, prompt = max(1, tokens or 1), prompt_tokens or 0
+            size = (prompt.bit_length(), completion.bit_length())
+            sample = latency / (completion + PROMPT_TOKEN_WEIGHT * prompt)
+            baseline = self.baselines.get(size)
+            if baseline is None or sample < baseline:
+                baseline = sample
+            slow = sample > self.tolerance * baseline
+            # il riferimento segue lentamente tutte le latenze (modello, host, carico di fondo),
+            # cosi' un minimo fortunato non fa ridurre il limite per sempre
+            self.baselines[size] = baseline + BASELINE_DRIFT * (sample - baseline)
+
+            if slow:
+                self._decrease(start, LIMIT_BACKOFF)
+            elif self.in_flight + 1 >= int(self.limit):
+                # si allarga solo se il limite e' effettivamente raggiunto
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _decrease(self, start, factor):
+        # una sola riduzione per "finestra": le richieste partite prima dell'ultima riduzione non contano
+        if start < self.last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.last_decrease = time.perf_counter()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "mean_wait": self.wait_time / self.waits if self.waits else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class Endpoint:
+    """Un'istanza Ollama della config_list, con le statistiche delle richieste inviate."""
+    def __init__(self, config):
+        self.config = config
+        self.name = config.get("base_url") or config["model"]
+        self.healthy = True
+        self.failures = 0           # errori consecutivi
+        self.limiter = AdaptiveLimiter(max_limit=config.get("max_concurrency", LIMIT_MAX))
+        self.requests = 0
+        self.errors = 0
+        self.busy_time = 0.0        # somma delle latenze delle richieste riuscite
+        self.completion_tokens = 0
+        self.first_request = None
+        self.last_request = None
+
+    @property
+    def client(self):
+        return get_client(self.config)
+
+    def params(self, params):
+        params = {**params, "model": self.config["model"]}
+        params.update({key: self.config[key] for key in SAMPLING_KEYS if key in self.config})
+        return params
+
+    @property
+    def load(self):
+        """Richieste in corso e in coda rispetto al limite attuale."""
+        return (self.limiter.in_flight + self.limiter.queued) / self.limiter.limit
+
+    def stats(self):
+        elapsed = (self.last_request - self.first_request) if self.first_request is not None else 0.0
+        ok = self.requests - self.errors
+        return {
+            "healthy": self.healthy,
+            **self.limiter.stats(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "mean_latency": self.busy_time / ok if ok else 0.0,
+            "requests_per_s": ok / elapsed if elapsed > 0 else 0.0,
+            "tokens_per_s": self.completion_tokens / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class EndpointPool:
+    """
+    Instrada ogni richiesta all'endpoint sano meno carico (richieste in corso e in coda rispetto
+    al limite adattivo dell'endpoint). Dopo max_failures
+    errori consecutivi un endpoint esce dalla rotazione; un controllo periodico (GET /models)
+    lo rimette in rotazione quando torna a rispondere. Lo stato e' usato solo dal loop condiviso.
+    """
+    def __init__(self, config_list, max_failures=MAX_FAILURES, health_interval=HEALTH_INTERVAL):
+        if not config_list:
+            raise ValueError("No LLM endpoint configured: config_list is empty")
+        self.endpoints = [Endpoint(config) for config in config_list]
+        self.max_failures = max_failures
+        self.health_interval = health_interval
+        self._health_task = None
+
+    def select(self, exclude=()):
+        candidates = [e for e in self.endpoints if e not in exclude]
+        healthy = [e for e in candidates if e.healthy]
+        # se nessun endpoint e' sano si prova comunque quello meno carico
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (e.load, e.requests))
+
+    async def create(self, params):
+        """chat.completions.create sull'endpoint meno carico, passando al successivo se fallisce."""
+        self._start_health_checks()
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self.select(exclude=tried)
+            if endpoint is None:
+                if last_error is None:
+                    raise RuntimeError("no LLM endpoint configured")
+                raise last_error
+            tried.append(endpoint)
+            try:
+                return await self._request(endpoint, params)
+            except openai.APIStatusError as e:
+                if e.status_code < 500:
+                    raise
+                last_error = e
+            except (openai.APIConnectionError, asyncio.TimeoutError) as e:
+                last_error = e
+
+    async def _request(self, endpoint, params):
+        start = await endpoint.limiter.acquire()
+        endpoint.requests += 1
+        if endpoint.first_request is None:
+            endpoint.first_request = start
+        try:
+            response = await endpoint.client.chat.completions.create(**endpoint.params(params))
+        except Exception as e:
+            endpoint.last_request = time.perf_counter()
+            endpoint.errors += 1
+            failure = not isinstance(e, openai.APIStatusError) or e.status_code >= 500
+            if failure:
+                self._record_failure(endpoint)
+            endpoint.limiter.release(start, error=failure)
+            raise
+        except BaseException:
+            # cancellazione: il posto viene liberato senza influire sul limite
+            endpoint.limiter.release(start)
+            raise
+
+        endpoint.last_request = time.perf_counter()
+        latency = endpoint.last_request - start
+        usage = response.usage
+        tokens = usage.completion_tokens if usage is not None else None
+        prompt_tokens = usage.prompt_tokens if usage is not None else None
+        endpoint.limiter.release(start, latency=latency, tokens=tokens, prompt_tokens=prompt_tokens)
+
+        endpoint.failures = 0
+        endpoint.healthy = True
+        endpoint.busy_time += latency
+        endpoint.completion_tokens += tokens or 0
+        return response
+
+    def _record_failure(self, endpoint):
+        endpoint.failures += 1
+        if endpoint.healthy and endpoint.failures >= self.max_failures:
+            endpoint.healthy = False
+            print(f"[LLM] endpoint {endpoint.name} removed from rotation after {endpoint.failures} failures")
+
+    def _start_health_checks(self):
+        if self._health_task is None and len(self.endpoints) > 1 and self.health_interval:
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    async def check_health(self):
+        """Interroga /models su ogni endpoint e aggiorna la rotazione."""
+        async def check(endpoint):
+            try:
+                await endpoint.client.with_options(timeout=HEALTH_TIMEOUT, max_retries=0).models.list()
+            except Exception:
+                endpoint.failures = max(endpoint.failures, self.max_failures)
+                if endpoint.healthy:
+                    endpoint.healthy = False
+                    print(f"[LLM] endpoint {endpoint.name} failed the health check, removed from rotation")
+                return
+            if not endpoint.healthy:
+                print(f"[LLM] endpoint {endpoint.name} is back in rotation")
+            endpoint.healthy = True
+            endpoint.failures = 0
+
+        await asyncio.gather(*(check(endpoint) for endpoint in self.endpoints))
+
+    def stats(self):
+        return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+
+
+def get_pool(config_list):
+    """EndpointPool condiviso per la config_list (stessi endpoint -> stesso pool e stesse statistiche)."""
+    key = tuple((config.get("base_url"), config.get("api_key"), config.get("model")) for config in config_list)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = EndpointPool(config_list)
+    return pool
+
+
+def endpoint_stats():
+    """Statistiche per endpoint di tutti i pool usati finora."""
+    stats = {}
+    with _lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        stats.update(pool.stats())
+    return stats
+
+
+def endpoint_report():
+    for name, stats in endpoint_stats().items():
+        state = "up" if stats["healthy"] else "DOWN"
+        print(
+            f"[LLM] {name} ({state}): {stats['requests']} requests, {stats['errors']} errors, "
+            f"{stats['mean_latency']:.2f}s mean latency, {stats['requests_per_s']:.2f} req/s, "
+            f"{stats['tokens_per_s']:.1f} tokens/s; concurrency limit {stats['limit']}, "
+            f"{stats['in_flight']} in flight, {stats['queued']} queued, "
+            f"wait {stats['mean_wait']:.2f}s mean / {stats['max_wait']:.2f}s max"
+        )
+
+
+def request_key(config_list, params):
+    """Hash della richiesta: modelli, messaggi (system message compreso) e parametri di generazione."""
+    models = sorted({config["model"] for config in config_list})
+    messages = [{"role": m.get("role"), "content": m.get("content")} for m in params["messages"]]
+    sampling = {k: v for k, v in params.items() if k != "messages"}
+    return text_key(
+        "llm-response",
+        json.dumps(models),
+        json.dumps(messages, sort_keys=True, ensure_ascii=False),
+        json.dumps(sampling, sort_keys=True),
+    )
+
+
+class ReplyMemo:
+    """
+    Risposte in memoria per un gruppo di chat (ad esempio le varianti di ablazione di un articolo):
+    una richiesta identica a una gia' fatta nel gruppo riceve la stessa risposta senza chiamare l'LLM.
+    """
+    def __init__(self):
+        self._data = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        content = self._data.get(key)
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def set(self, key, content):
+        self._data[key] = content
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+@contextlib.contextmanager
+def memo_scope(memo):
+    """Le chat avviate dal thread corrente all'interno del blocco condividono memo."""
+    token = _reply_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _reply_memo.reset(token)
+
+
+def current_memo():
+    return _reply_memo.get()
+
+
+def estimate_tokens(messages):
+    """Stima dei token di prompt dei messaggi (nessun tokenizer: circa CHARS_PER_TOKEN caratteri per token)."""
+    return sum(MESSAGE_TOKENS + len(str(m.get("content") or "")) // CHARS_PER_TOKEN for m in messages)
+
+
+def trim_messages(messages, max_tokens):
+    """
+    Riduce i messaggi entro max_tokens (stimati) eliminando i turni intermedi, i tentativi di
+    correzione, dai piu' vecchi, a coppie (risposta non valida e correzione). Non vengono mai
+    toccati i system message, il primo turno (il compito con l'articolo) e l'ultimo messaggio:
+    se senza turni intermedi il limite non e' rispettato, ValueError.
+    """
+    if estimate_tokens(messages) <= max_tokens:
+        return messages
+    turns = [i for i, m in enumerate(messages) if m.get("role") != "system"]
+    middle = turns[1:-1]
+    dropped = set()
+    while middle:
+        dropped.update(middle[:2])
+        middle = middle[2:]
+        trimmed = [m for i, m in enumerate(messages) if i not in dropped]
+        if estimate_tokens(trimmed) <= max_tokens:
+            return trimmed
+    required = estimate_tokens([m for i, m in enumerate(messages) if i not in dropped])
+    raise ValueError(
+        f"Prompt of about {required} tokens exceeds the context budget of {max_tokens} tokens "
+        f"(system message, task and latest message are never trimmed): raise --context-tokens or set it to 0"
+    )
+
+
+class ContextBudget:
+    """
+    Limite ai token di prompt delle chat di un articolo (vedi context_scope): prima di ogni
+    richiesta la storia della conversazione viene ridotta con trim_messages.
+    """
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+        self.requests = 0
+        self.trimmed = 0
+        self.prompt_tokens = 0
+        self.saved_tokens = 0
+
+    def apply(self, messages):
+        before = estimate_tokens(messages)
+        if self.max_tokens:
+            messages = trim_messages(messages, self.max_tokens)
+        after = estimate_tokens(messages)
+        self.requests += 1
+        self.prompt_tokens += after
+        if after < before:
+            self.trimmed += 1
+            self.saved_tokens += before - after
+        return messages
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "trimmed": self.trimmed,
+            "prompt_tokens": self.prompt_tokens,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+@contextlib.contextmanager
+def context_scope(budget):
+    """Le chat avviate dal thread corrente all'interno del blocco usano budget; all'uscita i conteggi vanno nei totali."""
+    token = _context_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _context_budget.reset(token)
+        with _lock:
+            _context_totals.update(budget.stats())
+
+
+def context_stats():
+    """Totali (token stimati) dei ContextBudget chiusi finora."""
+    with _lock:
+        return dict(_context_totals)
+
+
+class ResponseCache:
+    """
+    Risposte degli LLM su disco (SQLite), indirizzate dal contenuto della richiesta (request_key).
+    a_get/a_set eseguono le operazioni su SQLite in un thread, fuori dal loop degli eventi.
+    """
+    def __init__(self, path, max_bytes=RESPONSE_CACHE_BYTES):
+        # le risposte vanno da un breve JSON a un articolo riscritto: limite in byte, non in voci
+        self.disk = DiskCache(path, max_entries=None, max_bytes=max_bytes)
+
+    def get(self, key):
+        return self.disk.get(key)
+
+    def set(self, key, content):
+        self.disk.set(key, content)
+
+    async def a_get(self, key):
+        return await asyncio.to_thread(self.disk.get, key)
+
+    async def a_set(self, key, content):
+        await asyncio.to_thread(self.disk.set, key, content)
+
+    def close(self):
+        self.disk.close()
+
+    def stats(self):
+        return self.disk.stats()
+
+
+def set_response_cache(path, max_bytes=RESPONSE_CACHE_BYTES):
+    """Attiva la cache persistente delle risposte (path=None la disattiva)."""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = ResponseCache(path, max_bytes=max_bytes) if path else None
+    return _response_cache
+
+
+def close_response_cache():
+    """Salva gli accessi in sospeso e chiude la cache delle risposte."""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+        _response_cache = None
+
+
+def response_cache_stats():
+    return _response_cache.stats() if _response_cache is not None else None
+
+
+def request_params(agent, messages):
+    """(config_list dell'agente, parametri della richiesta chat.completions senza il modello)."""
+    llm_config = agent.llm_config
+    params = {"messages": messages}
+    params.update({key: llm_config[key] for key in SAMPLING_KEYS if key in llm_config})
+    return llm_config["config_list"], params
+
+
+async def a_generate_pooled_reply(agent, messages=None, sender=None, config=None):
+    """Reply function asincrona degli assistenti: una richiesta sul pool di endpoint condiviso, cancellabile."""
+    if not agent.llm_config:
+        return False, None
+    if messages is None:
+        messages = agent._oai_messages[sender]
+
+    messages = agent._oai_system_message + messages
+    budget = _context_budget.get()
+    if budget is not None:
+        messages = budget.apply(messages)
+    config_list, params = request_params(agent, messages)
+    memo, cache = (_reply_memo.get(), _response_cache) if _reuse_replies.get() else (None, None)
+    key = request_key(config_list, params) if memo is not None or cache is not None else None
+    if memo is not None:
+        content = memo.get(key)
+        if content is not None:
+            return True, content
+    if cache is not None:
+        content = await cache.a_get(key)
+        if content is not None:
+            if memo is not None:
+                memo.set(key, content)
+            return True, content
+
+    response = await get_pool(config_list).create(params)
+    content = response.choices[0].message.content
+    if content is not None:
+        if memo is not None:
+            memo.set(key, content)
+        if cache is not None:
+            await cache.a_set(key, content)
+    return True, content
+
+
+def enable_async_replies(agent):
+    """
+    Registra la reply function asincrona sull'agente. Viene usata solo nelle chat asincrone
+    (a_initiate_chat); initiate_chat continua a usare il client sincrono di autogen.
+    """
+    agent.register_reply([autogen.Agent, None], a_generate_pooled_reply, ignore_async_in_sync_chat=True)
+    return agent
+
+
+async def a_chat(sender, recipient, message, clear_history=True, timeout=None, memo=None):
+    """
+    Avvia la chat sender -> recipient e ne attende il risultato (ChatResult).
+    timeout: secondi per l'intera chat; alla scadenza la richiesta in corso viene cancellata.
+    memo: ReplyMemo da usare per le risposte (di default quello di memo_scope, se attivo).
+    Con clear_history=False (un nuovo tentativo dopo una risposta non valida) memo e cache
+    delle risposte non vengono usati: il tentativo deve arrivare all'LLM, non ripetere una
+    risposta gia' data in un'altra variante o in un'esecuzione precedente.
+    """
+    token = _reply_memo.set(memo) if memo is not None else None
+    reuse_token = _reuse_replies.set(clear_history)
+    try:
+        chat = sender.a_initiate_chat(recipient, message=message, clear_history=clear_history)
+        return await asyncio.wait_for(chat, timeout)
+    finally:
+        _reuse_replies.reset(reuse_token)
+        if token is not None:
+            _reply_memo.reset(token)
+
+
+def run(coro, timeout=None):
+    """Esegue la coroutine sul loop condiviso e ne attende il risultato dal thread chiamante."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        # timeout o interruzione: cancella la richiesta ancora in corso
+        future.cancel()
+        raise
+
+
+def close():
+    """Chiude i client HTTP condivisi e ferma il loop."""
+    global _loop
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _pools.clear()
+        loop, _loop = _loop, None
+    if loop is None:
+        return
+    for client in clients:
+        asyncio.run_coroutine_threadsafe(client.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
@@ -1,31 +1,106 @@
 import json
 import re
 from difflib import SequenceMatcher
-from utils import *
-from valid import *
 import time
-import pandas as pd
-from agents import *
-from evaluation import calculate_metrics
-from propaganda import apply_propaganda_technique
-from detector import model, bert_predict_with_chunking, explain_fake_text, tokenizer, FakeNewsDetector
 import os
 import csv
+import glob
 import argparse
+import atexit
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from startup import load_timer, startup_report
 
 parser = argparse.ArgumentParser(description="Fake News Generation Pipeline")
 parser.add_argument("--mode", type=int, choices=[1, 2, 3], help="1 = UniversalAgent, 2 = all agents active, 3 = deactivate one agent")
 parser.add_argument("--disable", type=int, choices=[1, 2, 3, 4], help="Agent to disable (if mode=3): 1=Semantic, 2=Salient, 3=Narrative, 4=Number")
+parser.add_argument("--ablation", action="store_true", help="Run mode 2 and mode 3 with each agent disabled (1-4) on every article in one process, sharing identical agent calls")
 parser.add_argument("--rounds", type=int, help="Number of modification rounds (must be >= 1)")
 parser.add_argument("--detector", type=str, choices=["bert", "llm"], default="bert", help="Method to use for fake news detection (bert or llm)")
+parser.add_argument("--backend", type=str, choices=["torch", "torch-int8", "onnx", "onnx-int8"], default="torch", help="Inference backend for the BERT detector (torch, torch-int8, onnx, onnx-int8)")
+parser.add_argument("--shap-max-evals", type=int, default=500, help="Maximum number of model evaluations per SHAP explanation")
+parser.add_argument("--shap-time-budget", type=float, default=None, help="Time budget in seconds per SHAP explanation (caps --shap-max-evals)")
+parser.add_argument("--prediction-cache-size", type=int, default=4096, help="Number of detector predictions kept in memory (0 disables the cache)")
+parser.add_argument("--prediction-cache", type=str, default=None, help="Optional SQLite file for a persistent detector prediction cache")
+parser.add_argument("--reference-cache", type=str, default=None, help="Optional directory where the prepared reference texts (tokens, n-grams, BERTScore embeddings) are persisted")
+parser.add_argument("--llm-cache", type=str, default=None, help="Optional SQLite file caching LLM responses across runs (keyed on model, messages and sampling parameters)")
+parser.add_argument("--llm-cache-size", type=int, default=512, help="Maximum size in MB of the LLM responses kept in --llm-cache, least recently used are evicted")
+parser.add_argument("--start", type=int, default=3100, help="First article index (position in the dataset after dropping incomplete rows)")
+parser.add_argument("--end", type=int, default=20000, help="Article index to stop at (exclusive)")
+parser.add_argument("--journal", type=str, default=None, help="Progress journal (default <output dir>/progress/journal.jsonl): completed articles are skipped on restart, failed or interrupted ones are retried")
+parser.add_argument("--shard", type=str, default=None, help="Process only shard k of N (k/N, 0 <= k < N): the articles whose index modulo N is k")
+parser.add_argument("--output-dir", type=str, default=None, help="Directory for metrics/, output_files/, agent_logs/, times/ and progress/ (default: current directory, shards/shard_k_of_N with --shard)")
+parser.add_argument("--run-store", type=str, default=None, help="Optional SQLite file (WAL) also recording articles, rounds, agent calls and timings; export it to CSV with runstore.py")
+parser.add_argument("--transcripts", type=str, default=None, help="Optional SQLite file storing the agent logs with deduplicated, compressed texts instead of agent_logs/agent_responses.csv; read it back with transcripts.py")
+parser.add_argument("--reload-prompts", action="store_true", help="Reload the prompt files in prompt/ and techniques_prompts/ when they change on disk during the run")
+parser.add_argument("--context-tokens", type=int, default=0, help="Prompt token budget per agent call: older validation retries of an article's conversation are dropped to fit, an article whose task alone does not fit fails (default 0 = no limit)")
+parser.add_argument("--workers", type=int, default=1, help="Number of articles processed concurrently (1 = sequential)")
+parser.add_argument("--startup-report", action="store_true", help="Print per-module import and model load times")
 args = parser.parse_args()
 
+shard = None
+if args.shard:
+    try:
+        shard = tuple(int(part) for part in args.shard.split("/"))
+    except ValueError:
+        shard = None
+    if shard is None or len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+        parser.error(f"--shard must be k/N with 0 <= k < N, got {args.shard!r}")
+
+output_dir = args.output_dir
+if output_dir is None:
+    output_dir = os.path.join("shards", f"shard_{shard[0]}_of_{shard[1]}") if shard else ""
+journal_path = args.journal or os.path.join(output_dir, "progress", "journal.jsonl")
+
+# gli import pesanti avvengono dopo il parsing, i modelli vengono caricati al primo utilizzo
+with load_timer("import pandas"):
+    import pandas as pd
+with load_timer("import agents (autogen)"):
+    from utils import *
+    from valid import *
+    from agents import *
+    from llm_client import endpoint_report, set_response_cache, close_response_cache, response_cache_stats, memo_scope, ReplyMemo, context_stats
+    from progress import ProgressJournal, STARTED, DONE, FAILED
+    from dataset import iter_articles
+    from merge_shards import compact_file
+    from writers import get_writer, flush_all, close_all
+    from runstore import RunStore
+    from transcripts import TranscriptStore
+    from prompts import load_prompts
+with load_timer("import evaluation"):
+    from evaluation import calculate_metrics, metrics_cache_stats, prepare_reference
+with load_timer("import propaganda"):
+    from propaganda import apply_propaganda_technique
+with load_timer("import detector (torch)"):
+    from detector import explain_fake_text, FakeNewsDetector, format_label_score, PredictionCache, model_identity
+
+#i prompt vengono letti e validati una volta qui, non a ogni articolo
+prompts = load_prompts(hot_reload=args.reload_prompts)
+
+prediction_cache = None
+if args.detector == "bert" and args.prediction_cache_size > 0:
+    prediction_cache = PredictionCache(
+        model_identity(args.backend),
+        maxsize=args.prediction_cache_size,
+        disk_path=args.prediction_cache
+    )
+    atexit.register(lambda: print(f"[CACHE] detector predictions: {prediction_cache.stats()}"))
+atexit.register(lambda: print(f"[CACHE] metrics: {metrics_cache_stats()}"))
+atexit.register(endpoint_report)
+atexit.register(lambda: print(f"[CONTEXT] estimated prompt tokens: {context_stats()}"))
+if args.llm_cache:
+    set_response_cache(args.llm_cache, max_bytes=args.llm_cache_size * 1024 * 1024)
+    atexit.register(lambda: print(f"[CACHE] LLM responses: {response_cache_stats()}"))
+
 newsdetector = FakeNewsDetector(
     method=args.detector,
-    model=model,
-    tokenizer=tokenizer,
-    llm_agent=LLMFakenewsAgent
+    backend=args.backend,
+    llm_agent=LLMFakenewsAgent,
+    cache=prediction_cache
 )
+if args.startup_report:
+    atexit.register(lambda: print(startup_report()))
 # === Fallback via input() se mancano o non validi ===
 agent_numbers = {
     1: "SemanticAnalyzer",
@@ -35,7 +110,7 @@ agent_numbers = {
 }
 
 # MODE
-while args.mode not in [1, 2, 3]:
+while not args.ablation and args.mode not in [1, 2, 3]:
     print("Select execution mode:")
     print("1 = UniversalAgent (single all-in-one agent)")
     print("2 = All agents active")
@@ -46,7 +121,7 @@ while args.mode not in [1, 2, 3]:
         pass
 
 # DISABLE (only if mode 3)
-if args.mode == 3:
+if args.mode == 3 and not args.ablation:
     while args.disable not in [1, 2, 3, 4]:
         print("Which agent do you want to deactivate?")
         for number, name in agent_numbers.items():
@@ -64,57 +139,79 @@ while args.rounds is None or args.rounds < 1:
         pass
 
 # === Final configuration ===
-USE_FULL_AGENT = args.mode == 1
-MANUALLY_DISABLED = []
-
-if args.mode == 3:
-    MANUALLY_DISABLED = [agent_numbers[args.disable]]
-
 max_rounds = args.rounds
 
-DISABLED_AGENTS = set(MANUALLY_DISABLED)
-if "SalientSentenceEditor" in DISABLED_AGENTS:
-    DISABLED_AGENTS.add("NarrativeModifier_Feedback")
-if "NumberModifier" in DISABLED_AGENTS:
-    DISABLED_AGENTS.add("NarrativeModifier_Numbers")
-
-
-if USE_FULL_AGENT:
-    output_csv = "metrics/full_metric.csv"
-    output_file = "output_files/output_full.csv"
+METRIC_HEADER = [
+    "index",
+    "initial_bleu", "initial_rouge1", "initial_rouge2", "initial_rougeL", "initial_readability", "initial_bert_score",
+    "final_bleu", "final_rouge1", "final_rouge2", "final_rougeL", "final_readability", "final_bert_score"
+]
+OUTPUT_FIELDNAMES = ["index", "original_title", "original_text", "modified_text_1", "modified_title", "modified_text", "initial_label_score", "final_label_score", "error"]
+
+class Variant:
+    """Configurazione della pipeline (modalita', agente disattivato) con i suoi file di metriche e output."""
+    def __init__(self, mode, disable=None):
+        self.use_full_agent = mode == 1
+        self.manually_disabled = [agent_numbers[disable]] if mode == 3 else []
+
+        self.disabled_agents = set(self.manually_disabled)
+        if "SalientSentenceEditor" in self.disabled_agents:
+            self.disabled_agents.add("NarrativeModifier_Feedback")
+        if "NumberModifier" in self.disabled_agents:
+            self.disabled_agents.add("NarrativeModifier_Numbers")
+
+        if self.use_full_agent:
+            self.name = "full"
+            metric_name, output_name = "full_metric.csv", "output_full.csv"
+        elif self.manually_disabled:
+            agent_code = self.manually_disabled[0]
+            self.name = f"no_{agent_code}"
+            metric_name, output_name = f"metric_no_{agent_code}.csv", f"output_no_{agent_code}.csv"
+        else:
+            self.name = "all_agents"
+            metric_name, output_name = "metric.csv", "output.csv"
+        self.output_csv = os.path.join(output_dir, "metrics", metric_name)
+        self.output_file = os.path.join(output_dir, "output_files", output_name)
+
+        os.makedirs(os.path.dirname(self.output_csv), exist_ok=True)
+        if not os.path.exists(self.output_csv):
+            with open(self.output_csv, mode="w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file)
+                writer.writerow(METRIC_HEADER)
+
+        os.makedirs(os.path.dirname(self.output_file), exist_ok=True)
+        if not os.path.exists(self.output_file):
+            with open(self.output_file, mode='w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=OUTPUT_FIELDNAMES)
+                writer.writeheader()
+
+        #i file creati prima dell'introduzione della colonna index mantengono la loro intestazione
+        with open(self.output_file, mode='r', newline='', encoding='utf-8') as f:
+            self.output_fieldnames = next(csv.reader(f), None) or OUTPUT_FIELDNAMES
+
+if args.ablation:
+    #matrice di ablazione: tutti gli agenti attivi e poi ciascuno dei quattro disattivato
+    variants = [Variant(2)] + [Variant(3, number) for number in agent_numbers]
 else:
-    if MANUALLY_DISABLED:
-        agent_code = MANUALLY_DISABLED[0]
-        output_csv = f"metrics/metric_no_{agent_code}.csv"
-        output_file = f"output_files/output_no_{agent_code}.csv"
-    else:
-        output_csv = "metrics/metric.csv"
-        output_file = "output_files/output.csv"
-
-os.makedirs("metrics", exist_ok=True)
-if not os.path.exists(output_csv):
-    with open(output_csv, mode="w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerow([
-            "index",
-            "initial_bleu", "initial_rouge1", "initial_rouge2", "initial_rougeL", "initial_readability", "initial_bert_score",
-            "final_bleu", "final_rouge1", "final_rouge2", "final_rougeL", "final_readability", "final_bert_score"
-        ])
-
-os.makedirs("output_files", exist_ok=True)
-if not os.path.exists(output_file):
-    with open(output_file, mode='w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=["original_title", "original_text", "modified_text_1", "modified_title", "modified_text", "initial_label_score", "final_label_score", "error"])
-        writer.writeheader()
+    variants = [Variant(args.mode, args.disable)]
 
 
-log_file = "agent_logs/agent_responses.csv"
-os.makedirs("agent_logs", exist_ok=True)
-if not os.path.exists(log_file):
+log_file = os.path.join(output_dir, "agent_logs", "agent_responses.csv")
+set_agent_log_file(log_file)
+transcript_store = TranscriptStore(args.transcripts) if args.transcripts else None
+set_transcript_store(transcript_store)
+if transcript_store:
+    atexit.register(lambda: print(f"[TRANSCRIPTS] {transcript_store.stats()}"))
+else:
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+if not transcript_store and not os.path.exists(log_file):
     with open(log_file, mode="w", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=["index", "agent_name", "input_message", "response_text", "round", "shap_explanation"])
         writer.writeheader()
 
+run_store = RunStore(args.run_store) if args.run_store else None
+set_run_store(run_store)
+
 
 #funzione per misurare il tempo di esecuzione di ogni agente
 def measure_agent_time(agent_name, function, *args, **kwargs):
@@ -124,32 +221,31 @@ def measure_agent_time(agent_name, function, *args, **kwargs):
     execution_time = end_time - start_time
     return response, execution_time
 
-#inizializza il tempo per gli agenti
-agent_metrics = {}
+#agenti di cui si misura il tempo
 ALL_AGENTS = [
     "SemanticAnalyzer", "SalientSentenceEditor", "NarrativeModifier", "NumberModifier",
     "TitleEditor", "Detector", "EvaluatorAgent", "SalientTextRewriter", "UniversalAgent"
 ]
 
-for agent in ALL_AGENTS:
-    agent_metrics[agent] = 0.0
-
-start_time_total = time.time()  
-
-file_path = "file/true1.csv"
-if not os.path.exists(file_path):
-    raise FileNotFoundError(f"Il file {file_path} non esiste. Assicurati che sia nella cartella 'file/'.")
-
-df = pd.read_csv(file_path, delimiter=';')
-df = df[['title', 'text']].dropna()
-
-for i in range(3100, 20000):  
+#le righe di metriche, output e tempi vengono accodate e scritte in background, un thread per file
+def append_csv_row(path, row, header=None):
+    get_writer(path, header=header).write(row)
+
+def append_output_row(variant, row):
+    get_writer(variant.output_file, fieldnames=variant.output_fieldnames).write(row)
+    if run_store:
+        run_store.add_article(variant.name, row)
+
+def process_article(i, title, text, agents, variant):
+    """
+    Esegue la pipeline completa su un articolo e scrive le righe di output, metriche e tempi.
+    Restituisce None se l'articolo e' stato completato, altrimenti il messaggio di errore.
+    """
+    agent_metrics = {agent: 0.0 for agent in ALL_AGENTS + ["EvaluatorAgent_Total"]}
+    original_text = text
+    original_title = title
     try: 
-        article = df.iloc[i]
-        title = article["title"]
-        text = article["text"]
-        original_text = text
-        original_title = title
+        reference = prepare_reference(original_text, cache_dir=args.reference_cache)
 
         results = []
         round_count = 0  
@@ -157,51 +253,50 @@ for i in range(3100, 20000):
         interation = 0
 
         while round_count < max_rounds:
-            print(f"\nRound {round_count + 1}/{max_rounds}...")
+            print(f"\n[{i}] Round {round_count + 1}/{max_rounds}...")
 
             if round_count == 0:
-                if USE_FULL_AGENT:
+                if variant.use_full_agent:
                     #newspaper_name = "BBC News, Reuters, The Guardian, The New York Times"
                     #newspaper_url = "https://www.bbc.com, https://www.reuters.com, https://www.theguardian.com, https://www.nytimes.com"
-                    with open("prompt/fullagent", "r") as f:
-                        selection_prompt = f.read()
+                    selection_prompt = prompts.text("prompt/fullagent")
                     full_message = f"Instructions:\n{selection_prompt}\nText:\n{original_text}"
                     #full_message = f"Instructions:\n{selection_prompt}\nFollow the journalistic style of {newspaper_name} {newspaper_url}\nText:\n{original_text}"
-                    response, exec_time = measure_agent_time("UniversalAgent", user_proxy.initiate_chat, UniversalAgent, message=full_message)
+                    response, exec_time = measure_agent_time("UniversalAgent", chat, agents.UniversalAgent, message=full_message)
                     agent_metrics["UniversalAgent"] = exec_time
-                    parsed = valid_modifiedtext(response.summary, UniversalAgent, original_text)
+                    parsed = valid_modifiedtext(response.summary, agents.UniversalAgent, original_text)
                     modified_text = parsed.get("modified_text", original_text)
                     #text = modified_text
                 else:
                     text = original_text 
 
             else:
-                if USE_FULL_AGENT:
+                if variant.use_full_agent:
                     message = f"Apply this feedback to improve the article:\n{feedback}\nOriginal text:\n{modified_text_final}"
-                    response, exec_time = measure_agent_time("UniversalAgent", user_proxy.initiate_chat, UniversalAgent,message=message)
+                    response, exec_time = measure_agent_time("UniversalAgent", chat, agents.UniversalAgent,message=message)
                     agent_metrics["UniversalAgent"] += exec_time
-                    parsed = valid_modifiedtext(response.summary, UniversalAgent, modified_text_final)
+                    parsed = valid_modifiedtext(response.summary, agents.UniversalAgent, modified_text_final)
                     modified_text = parsed.get("modified_text", modified_text_final)
                 else:
                     message = f"Apply this feedback:{feedback}\n to the text:\n:{modified_text_final}"
-                    response, exec_time = measure_agent_time("NarrativeModifier", user_proxy.initiate_chat, NarrativeModifier, message=message)
+                    response, exec_time = measure_agent_time("NarrativeModifier", chat, agents.NarrativeModifier, message=message)
                     agent_metrics["NarrativeModifier"] += exec_time
-                    parsed_r = valid_modifiedtext(response.summary, NarrativeModifier, original_text=modified_text_final)
+                    parsed_r = valid_modifiedtext(response.summary, agents.NarrativeModifier, original_text=modified_text_final)
                     modified_text = parsed_r.get("modified_text", "")
                     text = modified_text
                     response_to_log = response.summary if isinstance(parsed_r, str) else json.dumps(parsed_r)
                     log_agent_response(i, "NarrativeModifier", message, response_to_log, round_count)
 
-            if not USE_FULL_AGENT:
+            if not variant.use_full_agent:
                 sentence_to_modify = ""
                 modified_sentence = ""
                 numbers = []
 
-                if "SemanticAnalyzer" not in DISABLED_AGENTS:
+                if "SemanticAnalyzer" not in variant.disabled_agents:
                     message = f"Analyze the text:\n{text}"
-                    response, exec_time = measure_agent_time("SemanticAnalyzer", user_proxy.initiate_chat, SemanticAnalyzer, message=message)
+                    response, exec_time = measure_agent_time("SemanticAnalyzer", chat, agents.SemanticAnalyzer, message=message)
                     agent_metrics["SemanticAnalyzer"] = exec_time
-                    analysis_data = valid_semantic(response.summary, SemanticAnalyzer, text)
+                    analysis_data = valid_semantic(response.summary, agents.SemanticAnalyzer, text)
                     response_to_log = response.summary if isinstance(analysis_data, str) else json.dumps(analysis_data)
                     log_agent_response(i, "SemanticAnalyzer", message, response_to_log, round_count)
                     key_sentences = analysis_data.get("key_sentences", [])
@@ -211,34 +306,33 @@ for i in range(3100, 20000):
                     sentence_to_modify = text.split(".")[0] + "." if "." in text else text
                     numbers = []
                 
-                if "SalientSentenceEditor" not in DISABLED_AGENTS:    
+                if "SalientSentenceEditor" not in variant.disabled_agents:    
                     message = f"Modify this sentence: {sentence_to_modify}"
-                    response, exec_time = measure_agent_time("SalientSentenceEditor", user_proxy.initiate_chat, SalientSentenceEditor, message=message)
+                    response, exec_time = measure_agent_time("SalientSentenceEditor", chat, agents.SalientSentenceEditor, message=message)
                     agent_metrics["SalientSentenceEditor"] = exec_time
-                    parsed_response = valid_sentence(response.summary, SalientSentenceEditor, sentence_to_modify)
+                    parsed_response = valid_sentence(response.summary, agents.SalientSentenceEditor, sentence_to_modify)
                     modified_sentence = parsed_response.get("modified_sentence","")
                     response_to_log = response.summary if isinstance(parsed_response, str) else json.dumps(parsed_response)
                     log_agent_response(i, "SalientSentenceEditor", message, response_to_log, round_count)
                 else:
                     modified_sentence = sentence_to_modify
 
-                if "NarrativeModifier_Feedback" not in DISABLED_AGENTS:
-                    with open("prompt/propaganda_feedback", "r") as f:
-                        propaganda_feedback_prompt = f.read()
-            
+                if "NarrativeModifier_Feedback" not in variant.disabled_agents:
+                    propaganda_feedback_prompt = prompts.text("prompt/propaganda_feedback")
+
                     message = f"{propaganda_feedback_prompt}\nSentence: {modified_sentence}"
-                    response, exec_time = measure_agent_time("NarrativeModifier", user_proxy.initiate_chat, NarrativeModifier, message=message)
+                    response, exec_time = measure_agent_time("NarrativeModifier", chat, agents.NarrativeModifier, message=message)
                     agent_metrics["NarrativeModifier"] = exec_time
-                    parsed_data = valid_feedback(response.summary, NarrativeModifier, default_feedback="Please revise the sentence")
+                    parsed_data = valid_feedback(response.summary, agents.NarrativeModifier, default_feedback="Please revise the sentence")
                     feedback = parsed_data.get("feedback", "")
                     response_to_log = response.summary if isinstance(parsed_data, str) else json.dumps(parsed_data)
                     log_agent_response(i, "NarrativeModifier", message, response_to_log, round_count)
 
-                    if feedback and "SalientSentenceEditor" not in DISABLED_AGENTS:
+                    if feedback and "SalientSentenceEditor" not in variant.disabled_agents:
                         message = f"Revise the sentence based on this feedback: {feedback}"
-                        response, exec_time = measure_agent_time("SalientSentenceEditor", user_proxy.initiate_chat, SalientSentenceEditor, message=message)
+                        response, exec_time = measure_agent_time("SalientSentenceEditor", chat, agents.SalientSentenceEditor, message=message)
                         agent_metrics["SalientSentenceEditor"] += exec_time
-                        parsed_d = valid_sentence(response.summary, SalientSentenceEditor, sentence_to_modify)
+                        parsed_d = valid_sentence(response.summary, agents.SalientSentenceEditor, sentence_to_modify)
                         modified_sentence = parsed_d.get("modified_sentence", "")
                         response_to_log = response.summary if isinstance(parsed_d, str) else json.dumps(parsed_d)
                         log_agent_response(i, "SalientSentenceEditor", message, response_to_log, round_count)
@@ -255,44 +349,42 @@ for i in range(3100, 20000):
                 "modified_text": "the full updated text here"
                 }}
                 """
-                response, exec_time = measure_agent_time("SalientTextRewriter", user_proxy.initiate_chat, SalientTextRewriter, message=message)
+                response, exec_time = measure_agent_time("SalientTextRewriter", chat, agents.SalientTextRewriter, message=message)
                 agent_metrics["SalientTextRewriter"] = exec_time  
-                parsed_ = valid_modifiedtext(response.summary, SalientTextRewriter, original_text=text)
+                parsed_ = valid_modifiedtext(response.summary, agents.SalientTextRewriter, original_text=text)
                 text = parsed_.get("modified_text", "")
                 response_to_log = response.summary if isinstance(parsed_, str) else json.dumps(parsed_)
                 log_agent_response(i, "SalientTextRewriter", message, response_to_log, round_count)
 
-                if "NarrativeModifier" not in DISABLED_AGENTS:
-                    modified_text = apply_propaganda_technique(text, i, round_count)
+                if "NarrativeModifier" not in variant.disabled_agents:
+                    modified_text = apply_propaganda_technique(text, i, round_count, agent=agents.NarrativeModifier)
                 else:
                     modified_text = text
 
-                if "NumberModifier" not in DISABLED_AGENTS:    
-                    with open("prompt/number_feedback", "r") as f:
-                        number_feedback_prompt = f.read()
-
+                if "NumberModifier" not in variant.disabled_agents:    
                     message = f"Modify numbers in text:\n{modified_text}"
-                    response, exec_time = measure_agent_time("NumberModifier", user_proxy.initiate_chat, NumberModifier, message=message)
+                    response, exec_time = measure_agent_time("NumberModifier", chat, agents.NumberModifier, message=message)
                     agent_metrics["NumberModifier"] = exec_time
-                    parsed_number = valid_modifiedtext(response.summary, NumberModifier, original_text=modified_text)
+                    parsed_number = valid_modifiedtext(response.summary, agents.NumberModifier, original_text=modified_text)
                     modified_text = parsed_number.get("modified_text", "")
                     response_to_log = response.summary if isinstance(parsed_number, str) else json.dumps(parsed_number)
                     log_agent_response(i, "NumberModifier", message, response_to_log, round_count)
 
-                if "NarrativeModifier_Numbers" not in DISABLED_AGENTS:
+                if "NarrativeModifier_Numbers" not in variant.disabled_agents:
+                    number_feedback_prompt = prompts.text("prompt/number_feedback")
                     message = f"{number_feedback_prompt}\nText: {modified_text}"
-                    response, exec_time = measure_agent_time("NarrativeModifier", user_proxy.initiate_chat, NarrativeModifier, message=message)
+                    response, exec_time = measure_agent_time("NarrativeModifier", chat, agents.NarrativeModifier, message=message)
                     agent_metrics["NarrativeModifier"] += exec_time
-                    parsed_feed = valid_feedback(response.summary, NarrativeModifier, default_feedback="Please revise number consistency.")
+                    parsed_feed = valid_feedback(response.summary, agents.NarrativeModifier, default_feedback="Please revise number consistency.")
                     feedback = parsed_feed.get("feedback", "")
                     response_to_log = response.summary if isinstance(parsed_feed, str) else json.dumps(parsed_feed)
                     log_agent_response(i, "NarrativeModifier", message, response_to_log, round_count)
 
                     if feedback:
                         message = f"Revise numbers based on feedback:\n{feedback}\nOriginal text:\n{modified_text}"
-                        response, exec_time = measure_agent_time("NumberModifier", user_proxy.initiate_chat, NumberModifier, message=message)
+                        response, exec_time = measure_agent_time("NumberModifier", chat, agents.NumberModifier, message=message)
                         agent_metrics["NumberModifier"] += exec_time
-                        parsed_n = valid_modifiedtext(response.summary, NumberModifier, original_text=modified_text)
+                        parsed_n = valid_modifiedtext(response.summary, agents.NumberModifier, original_text=modified_text)
                         modified_text = parsed_n.get("modified_text", "")
                         response_to_log = response.summary if isinstance(parsed_n, str) else json.dumps(parsed_n)
                         log_agent_response(i, "NumberModifier", message, response_to_log, round_count)
@@ -300,9 +392,9 @@ for i in range(3100, 20000):
                         pass
                         
             def evaluate_text_with_agent(original_text, modified_text, index):       
-                evaluation_metrics = calculate_metrics(original_text, modified_text)
+                evaluation_metrics = calculate_metrics(reference, modified_text)
 
-                if USE_FULL_AGENT:
+                if variant.use_full_agent:
                     target_agents = ["UniversalAgent"]
                 else:
                     target_agents = ["NarrativeModifier", "NumberModifier"]
@@ -316,14 +408,14 @@ for i in range(3100, 20000):
 
                 evaluation_response, exec_time = measure_agent_time(
                     "EvaluatorAgent", 
-                    user_proxy.initiate_chat, 
-                    EvaluatorAgent, 
+                    chat, 
+                    agents.EvaluatorAgent, 
                     message=message_content
                 )
 
                 agent_metrics["EvaluatorAgent"] = exec_time
                 
-                evaluation_data = valid_evaluator(evaluation_response.summary)
+                evaluation_data = valid_evaluator(evaluation_response.summary, agent=agents.EvaluatorAgent)
                 feedback_data = evaluation_data.get("feedback", [])
 
                 evaluation_results = {
@@ -336,7 +428,7 @@ for i in range(3100, 20000):
 
                 log_agent_response(index, "EvaluatorAgent", message_content, evaluation_response.summary, round_count)
 
-                if USE_FULL_AGENT and feedback_data:
+                if variant.use_full_agent and feedback_data:
                     for feedback in feedback_data:
                         agent_name = feedback.get("agent", "Unknown")
                         message = feedback.get("message", "")
@@ -344,13 +436,13 @@ for i in range(3100, 20000):
                         Ensure the revised text completely replaces the original passage.
                         text: "{modified_text}"
                         """
-                        response, exec_time = measure_agent_time("UniversalAgent", user_proxy.initiate_chat, UniversalAgent, message=agent_message)
+                        response, exec_time = measure_agent_time("UniversalAgent", chat, agents.UniversalAgent, message=agent_message)
                         agent_metrics["UniversalAgent"] += exec_time
-                        parsed = valid_modifiedtext(response.summary, UniversalAgent, modified_text)
+                        parsed = valid_modifiedtext(response.summary, agents.UniversalAgent, modified_text)
                         modified_text = parsed.get("modified_text", modified_text)
 
                 # === PIPELINE CLASSICA ===
-                elif not USE_FULL_AGENT and feedback_data:
+                elif not variant.use_full_agent and feedback_data:
                     for feedback in feedback_data:
                         agent_name = feedback.get("agent", "Unknown")
                         message = feedback.get("message", "")
@@ -360,9 +452,9 @@ for i in range(3100, 20000):
                             Ensure the revised text completely replaces the original passage.
                             text: "{modified_text}"
                             """
-                            response, exec_time = measure_agent_time("NarrativeModifier", user_proxy.initiate_chat, NarrativeModifier, message=narrative_message)
+                            response, exec_time = measure_agent_time("NarrativeModifier", chat, agents.NarrativeModifier, message=narrative_message)
                             agent_metrics["NarrativeModifier"] += exec_time
-                            parsed_json = valid_modifiedtext(response.summary, NarrativeModifier, original_text=modified_text)
+                            parsed_json = valid_modifiedtext(response.summary, agents.NarrativeModifier, original_text=modified_text)
                             modified_text = parsed_json.get("modified_text","")
                             response_to_log = response.summary if isinstance(parsed_json, str) else json.dumps(parsed_json)
                             log_agent_response(index, "NarrativeModifier", narrative_message, response_to_log, round_count)
@@ -372,9 +464,9 @@ for i in range(3100, 20000):
                             Ensure all number-related corrections are applied properly.
                             text: "{modified_text}"
                             """
-                            response, exec_time = measure_agent_time("NumberModifier", user_proxy.initiate_chat, NumberModifier, message=number_message)
+                            response, exec_time = measure_agent_time("NumberModifier", chat, agents.NumberModifier, message=number_message)
                             agent_metrics["NumberModifier"] += exec_time
-                            parsed_j = valid_modifiedtext(response.summary, NumberModifier, original_text=modified_text)
+                            parsed_j = valid_modifiedtext(response.summary, agents.NumberModifier, original_text=modified_text)
                             modified_text = parsed_j.get("modified_text","")
                             response_to_log = response.summary if isinstance(parsed_j, str) else json.dumps(parsed_j)
                             log_agent_response(index, "NumberModifier", number_message, response_to_log, round_count)
@@ -387,112 +479,219 @@ for i in range(3100, 20000):
             evaluation_start_time = time.time()
             modified_text_final, evaluation_results = evaluate_text_with_agent(original_text, modified_text, i)
             evaluation_end_time = time.time()
-            final_metrics = calculate_metrics(original_text, modified_text_final)
+            final_metrics = calculate_metrics(reference, modified_text_final)
             evaluation_results.update(final_metrics)
 
             agent_metrics["EvaluatorAgent_Total"] = evaluation_end_time - evaluation_start_time
 
             label, probs = newsdetector.predict(modified_text_final)
-            real_score = round(float(probs[0]), 4)
-            fake_score = round(float(probs[1]), 4)
-            label_score_str = f"{label} (Fake: {fake_score}, Real: {real_score})"
-            
+            label_score_str = format_label_score(label, probs)
+            if run_store:
+                run_store.add_round(variant.name, i, round_count, label, probs, final_metrics)
+
             if round_count == 0:
                 modified_text_1 = modified_text_final
                 initial_label_score = label_score_str
-                initial_metrics = calculate_metrics(original_text, modified_text_final)
+                initial_metrics = calculate_metrics(reference, modified_text_final)
 
             if label == "Real":
                 final_label_score = label_score_str
-                final_metrics = calculate_metrics(original_text, modified_text_final)
+                final_metrics = calculate_metrics(reference, modified_text_final)
                 modified_text = modified_text_final
                 break
             
             if label == "Fake":
-                important_words, key_phrases = explain_fake_text(modified_text_final)
+                important_words, key_phrases = explain_fake_text(
+                    modified_text_final,
+                    max_evals=args.shap_max_evals,
+                    time_budget=args.shap_time_budget
+                )
                 message=f"Revise the text based on this words and phrases:\n{important_words}\n{key_phrases}\nText: {modified_text_final}"
-                response, exec_time = measure_agent_time("Detector", user_proxy.initiate_chat, Detector, message=message)
-                parsed_fb = valid_feedback(response.summary, Detector, default_feedback="Please revise the text based on highlighted weaknesses." )
+                response, exec_time = measure_agent_time("Detector", chat, agents.Detector, message=message)
+                parsed_fb = valid_feedback(response.summary, agents.Detector, default_feedback="Please revise the text based on highlighted weaknesses." )
                 feedback = parsed_fb.get("feedback", "")
                 response_to_log = response.summary if isinstance(parsed_fb, str) else json.dumps(parsed_fb)
                 log_agent_response(i, "Detector", message, response_to_log, round_count, shap_words=important_words, shap_phrases=key_phrases)
             round_count += 1 
 
         final_label_score = label_score_str
-        final_metrics = calculate_metrics(original_text, modified_text_final)
+        final_metrics = calculate_metrics(reference, modified_text_final)
         modified_text = modified_text_final
         
         rouge = final_metrics["rouge"]
-        with open(output_csv, mode="a", newline="", encoding="utf-8") as file:
-            writer = csv.writer(file)
-            writer.writerow([
-                i,
-                initial_metrics.get("bleu", ""),
-                initial_metrics.get("rouge", {}).get("rouge1", ""),
-                initial_metrics.get("rouge", {}).get("rouge2", ""),
-                initial_metrics.get("rouge", {}).get("rougeL", ""),
-                initial_metrics.get("readability", ""),
-                initial_metrics.get("bert_score", ""),
-                final_metrics.get("bleu", ""),
-                final_metrics.get("rouge", {}).get("rouge1", ""),
-                final_metrics.get("rouge", {}).get("rouge2", ""),
-                final_metrics.get("rouge", {}).get("rougeL", ""),
-                final_metrics.get("readability", ""),
-                final_metrics.get("bert_score", "")
-            ])
+        metric_row = [
+            i,
+            initial_metrics.get("bleu", ""),
+            initial_metrics.get("rouge", {}).get("rouge1", ""),
+            initial_metrics.get("rouge", {}).get("rouge2", ""),
+            initial_metrics.get("rouge", {}).get("rougeL", ""),
+            initial_metrics.get("readability", ""),
+            initial_metrics.get("bert_score", ""),
+            final_metrics.get("bleu", ""),
+            final_metrics.get("rouge", {}).get("rouge1", ""),
+            final_metrics.get("rouge", {}).get("rouge2", ""),
+            final_metrics.get("rouge", {}).get("rougeL", ""),
+            final_metrics.get("readability", ""),
+            final_metrics.get("bert_score", "")
+        ]
+        append_csv_row(variant.output_csv, metric_row)
+        if run_store:
+            run_store.add_metrics(variant.name, metric_row)
 
         message = f"Generate a new title based on this text:\n{modified_text_final}"
-        response, exec_time = measure_agent_time("TitleEditor", user_proxy.initiate_chat, TitleEditor, message=message)
+        response, exec_time = measure_agent_time("TitleEditor", chat, agents.TitleEditor, message=message)
         agent_metrics["TitleEditor"] = exec_time
-        parsed_title = valid_title(response.summary, original_title=title)
+        parsed_title = valid_title(response.summary, original_title=title, agent=agents.TitleEditor)
         modified_title = parsed_title.get("title", title)
         response_to_log = response.summary if isinstance(parsed_title, str) else json.dumps(parsed_title)
         log_agent_response(i, "TitleEditor", message, response_to_log, round_count)
 
-        with open(output_file, mode='a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=["original_title", "original_text", "modified_text_1", "modified_title", "modified_text", "initial_label_score", "final_label_score", "error"])
-            writer.writerow({
-                "original_title": original_title,
-                "original_text": original_text,
-                "modified_text_1": modified_text_1,
-                "modified_title": modified_title,
-                "modified_text": modified_text,
-                "initial_label_score": initial_label_score,
-                "final_label_score": final_label_score,
-                "error": ""
-            })
+        append_output_row(variant, {
+            "index": i,
+            "original_title": original_title,
+            "original_text": original_text,
+            "modified_text_1": modified_text_1,
+            "modified_title": modified_title,
+            "modified_text": modified_text,
+            "initial_label_score": initial_label_score,
+            "final_label_score": final_label_score,
+            "error": ""
+        })
     
         end_time_total = time.time()
         total_execution_time = end_time_total - start_time_total
         
-        agent_timing_file = "times/time.csv"
+        agent_timing_file = os.path.join(output_dir, "times", "time.csv")
         header = ["index"] + list(agent_metrics.keys()) + ["total_execution_time"]
-        os.makedirs("times", exist_ok=True)
-        if not os.path.exists(agent_timing_file):
-            with open(agent_timing_file, mode="w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow(header)
-        with open(agent_timing_file, mode="a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            row = [i] + [agent_metrics.get(agent, 0.0) for agent in header[1:-1]] + [total_execution_time]
-            writer.writerow(row)
+        os.makedirs(os.path.dirname(agent_timing_file), exist_ok=True)
+        row = [i] + [agent_metrics.get(agent, 0.0) for agent in header[1:-1]] + [total_execution_time]
+        append_csv_row(agent_timing_file, row, header=header)
+        if run_store:
+            run_store.add_timing(variant.name, header, row)
+        return None
 
     except Exception as e:
         print(f"[ERROR] Error processing article {i}: {e}")        
 
-        with open(output_file, mode='a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=["original_title", "original_text", "modified_title", "modified_text", "initial_label_score", "final_label_score", "error"])
-            writer.writerow({
-                "original_title": title if 'title' in locals() else "",
-                "original_text": text if 'text' in locals() else "",
-                "modified_text_1": "",
-                "modified_title": "",
-                "modified_text": "",
-                "initial_label_score": "",
-                "final_label_score": "",
-                "error": str(e)
-            })
-
-        continue
-
-    
\ No newline at end of file
+        append_output_row(variant, {
+            "index": i,
+            "original_title": original_title,
+            "original_text": original_text,
+            "modified_text_1": "",
+            "modified_title": "",
+            "modified_text": "",
+            "initial_label_score": "",
+            "final_label_score": "",
+            "error": str(e)
+        })
+        return str(e)
+
+
+start_time_total = time.time()  
+
+file_path = "file/true1.csv"
+if not os.path.exists(file_path):
+    raise FileNotFoundError(f"Il file {file_path} non esiste. Assicurati che sia nella cartella 'file/'.")
+
+journal = ProgressJournal(journal_path)
+
+#articoli ripresi dopo un tentativo fallito o interrotto: le righe di quel tentativo sono ancora nei file
+retried_articles = set()
+
+def run_variant(i, title, text, agents, variant):
+    if journal.status(i, variant.name) in (STARTED, FAILED):
+        retried_articles.add(i)
+    journal.mark(i, STARTED, variant.name)
+    if run_store:
+        run_store.set_variant(variant.name)
+    #storia delle conversazioni limitata all'articolo e prompt entro --context-tokens
+    with article_scope(agents, max_tokens=args.context_tokens or None):
+        error = process_article(i, title, text, agents, variant)
+    #le righe dell'articolo devono essere su file prima che il journal lo segni come completato:
+    #se una scrittura e' fallita l'articolo resta FAILED e viene ripreso al riavvio
+    try:
+        flush_all()
+        if run_store:
+            run_store.flush()
+        if transcript_store:
+            transcript_store.flush()
+    except RuntimeError as e:
+        print(f"[ERROR] Rows of article {i} not written: {e}")
+        error = error or f"rows not written: {e}"
+    journal.mark(i, FAILED if error else DONE, variant.name, error=error)
+
+def run_article(i, title, text):
+    agents = thread_agents()
+    pending = [variant for variant in variants if not journal.is_done(i, variant.name)]
+    if len(pending) == 1:
+        run_variant(i, title, text, agents, pending[0])
+        return
+
+    #le varianti condividono le risposte alle richieste identiche: i passi a monte comuni vengono eseguiti una volta
+    with memo_scope(ReplyMemo()) as memo:
+        for variant in pending:
+            print(f"\n[{i}] Variant {variant.name}")
+            run_variant(i, title, text, agents, variant)
+    print(f"[{i}] Shared agent replies across variants: {memo.stats()}")
+
+#il dataset viene letto a blocchi mentre si procede; shard k di N prende gli articoli con indice % N == k
+requested = []
+def pending_articles():
+    for i, title, text in iter_articles(file_path, start=args.start, end=args.end, shard=shard):
+        requested.append(i)
+        if not all(journal.is_done(i, variant.name) for variant in variants):
+            yield i, title, text
+
+failed_articles = []
+if args.workers <= 1:
+    for i, title, text in pending_articles():
+        run_article(i, title, text)
+else:
+    # al massimo args.workers articoli in esecuzione; le predizioni BERT dei vari articoli vengono valutate in batch comuni
+    # .result() fa emergere le eccezioni dei worker: ogni articolo fallito viene riportato col suo indice
+    def collect(done):
+        for future in done:
+            i = article_of.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                failed_articles.append(i)
+                print(f"[{i}] Article failed in worker: {e!r}")
+                traceback.print_exception(type(e), e, e.__traceback__)
+
+    newsdetector.start_queue()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        article_of = {}
+        for i, title, text in pending_articles():
+            if len(article_of) >= args.workers:
+                done, _ = wait(article_of, return_when=FIRST_COMPLETED)
+                collect(done)
+            article_of[pool.submit(run_article, i, title, text)] = i
+        collect(as_completed(list(article_of)))
+    newsdetector.stop_queue()
+
+close_all()
+if retried_articles:
+    # una riga per articolo nei file di metriche e di output: restano quelle dell'ultimo tentativo
+    for subdir in ("metrics", "output_files"):
+        for path in sorted(glob.glob(os.path.join(output_dir, subdir, "*.csv"))):
+            try:
+                removed = compact_file(path)
+            except ValueError as e:
+                print(f"[PROGRESS] Cannot remove the rows of earlier attempts from {path}: {e}")
+                continue
+            if removed:
+                print(f"[PROGRESS] {path}: removed {removed} rows of earlier attempts")
+if prediction_cache:
+    prediction_cache.close()
+close_response_cache()
+if run_store:
+    run_store.close()
+if transcript_store:
+    transcript_store.close()
+journal.close()
+variant_names = [variant.name for variant in variants]
+print(f"[PROGRESS] {len(requested)} articles in range ({journal_path}): {journal.summary(requested, variant_names)}")
+if failed_articles:
+    print(f"[PROGRESS] {len(failed_articles)} articles raised an exception: {sorted(failed_articles)}")
+    sys.exit(1)
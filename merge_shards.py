@@ -0,0 +1,86 @@
+import argparse
+import glob
+import os
+import pandas as pd
+
+# Unisce gli output delle shard (main.py --shard k/N) nei file canonici, ordinati per indice.
+# metrics/ e output_files/ hanno una riga per articolo: per ogni indice resta l'ultima riga,
+# preferendo quelle senza errore. agent_logs/ e times/ hanno piu' righe per articolo:
+# si eliminano solo le righe duplicate.
+
+ONE_ROW_PER_INDEX = ("metrics", "output_files")
+MANY_ROWS_PER_INDEX = ("agent_logs", "times")
+
+
+def shard_files(shard_dirs):
+    """Percorsi relativi (es. metrics/metric.csv) -> file delle shard che li contengono."""
+    files = {}
+    for shard_dir in shard_dirs:
+        for subdir in ONE_ROW_PER_INDEX + MANY_ROWS_PER_INDEX:
+            for path in sorted(glob.glob(os.path.join(shard_dir, subdir, "*.csv"))):
+                files.setdefault(os.path.relpath(path, shard_dir), []).append(path)
+    return files
+
+
+def merge_frames(frames, one_row_per_index):
+    df = pd.concat(frames, ignore_index=True, sort=False).fillna("")
+    if "index" not in df.columns:
+        raise ValueError("missing 'index' column")
+    df["_order"] = range(len(df))
+    df["_index"] = pd.to_numeric(df["index"], errors="coerce")
+
+    if one_row_per_index:
+        # per ogni indice si tiene l'ultima riga scritta, preferendo quelle senza errore
+        df["_ok"] = ~df["error"].astype(bool) if "error" in df.columns else True
+        df = df.sort_values(["_index", "_ok", "_order"]).drop_duplicates(subset="_index", keep="last")
+    else:
+        df = df.drop_duplicates(subset=[c for c in df.columns if c not in ("_order", "_index")])
+
+    df = df.sort_values(["_index", "_order"], kind="stable")
+    return df.drop(columns=[c for c in ("_order", "_index", "_ok") if c in df.columns])
+
+
+def merge_file(relative_path, paths, output_dir):
+    target = os.path.join(output_dir, relative_path)
+    sources = ([target] if os.path.exists(target) else []) + paths
+    frames = [pd.read_csv(path, dtype=str, keep_default_na=False) for path in sources]
+    columns = list(frames[-1].columns)
+
+    one_row_per_index = relative_path.split(os.sep)[0] in ONE_ROW_PER_INDEX
+    merged = merge_frames(frames, one_row_per_index)
+    merged = merged[columns + [c for c in merged.columns if c not in columns]]
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + ".tmp"
+    merged.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, target)
+    return len(merged)
+
+
+def compact_file(path):
+    """
+    Lascia una riga per indice in un file di metrics/ o output_files/ (l'ultima, preferendo
+    quelle senza errore): usato da main.py dopo aver ripreso articoli falliti o interrotti.
+    """
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    columns = list(df.columns)
+    merged = merge_frames([df], one_row_per_index=True)[columns]
+    tmp_path = path + ".tmp"
+    merged.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return len(df) - len(merged)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the per-shard outputs of main.py --shard into the canonical files")
+    parser.add_argument("--shards", type=str, nargs="+", default=None, help="Shard output directories (default: shards/shard_*)")
+    parser.add_argument("--output-dir", type=str, default=".", help="Directory holding the canonical metrics/, output_files/, agent_logs/ and times/")
+    args = parser.parse_args()
+
+    shard_dirs = args.shards or sorted(glob.glob(os.path.join("shards", "shard_*")))
+    if not shard_dirs:
+        raise SystemExit("No shard directories found")
+
+    for relative_path, paths in sorted(shard_files(shard_dirs).items()):
+        rows = merge_file(relative_path, paths, args.output_dir)
+        print(f"{relative_path}: {len(paths)} shard files -> {rows} rows")
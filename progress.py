@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+
+# Journal delle esecuzioni: per ogni articolo (e variante) l'ultimo stato registrato.
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+
+
+class ProgressJournal:
+    """
+    Journal JSONL append-only, una riga per cambio di stato (started, done, failed) di un
+    articolo in una variante. Ogni riga viene scritta su disco (fsync) prima di proseguire,
+    cosi' dopo un crash lo stato e' quello dell'ultima riga completa.
+    """
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._status = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # riga troncata da un crash durante la scrittura
+                        continue
+                    self._status[(entry["index"], entry.get("variant", ""))] = entry["status"]
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                truncated = f.read(1) != b"\n"
+            if truncated:
+                # chiude la riga incompleta, che viene ignorata alla lettura
+                self._file.write("\n")
+                self._file.flush()
+
+    def status(self, index, variant=""):
+        with self._lock:
+            return self._status.get((index, variant))
+
+    def is_done(self, index, variant=""):
+        return self.status(index, variant) == DONE
+
+    def mark(self, index, status, variant="", error=None):
+        entry = {"index": index, "variant": variant, "status": status, "time": time.time()}
+        if error:
+            entry["error"] = error
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._status[(index, variant)] = status
+
+    def summary(self, indices=None, variants=("",)):
+        """Numero di coppie (articolo, variante) per stato tra gli indici indicati."""
+        counts = {DONE: 0, FAILED: 0, STARTED: 0, "not_started": 0}
+        with self._lock:
+            keys = self._status.keys() if indices is None else [(i, v) for i in indices for v in variants]
+            for key in keys:
+                counts[self._status.get(key, "not_started")] += 1
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._file.close()
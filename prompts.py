@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+# Registro dei prompt: i file di prompt/ e techniques_prompts/ vengono letti e validati una volta
+# all'avvio. Ogni template e' gia' diviso sul segnaposto {{text}}, quindi render() e' un join.
+# Con hot_reload la data di modifica dei file viene ricontrollata (al piu' ogni check_interval
+# secondi) e i template modificati vengono ricaricati.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROMPT_DIRS = ("prompt", "techniques_prompts")
+PLACEHOLDER = "{{text}}"
+# cartelle i cui template devono contenere il segnaposto
+REQUIRES_PLACEHOLDER = ("techniques_prompts",)
+CHECK_INTERVAL = 1.0
+
+
+class PromptTemplate:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        if not text.strip():
+            raise ValueError(f"Prompt {self.name} is empty ({self.path})")
+        parts = text.split(PLACEHOLDER)
+        if len(parts) == 1 and self.name.split("/")[0] in REQUIRES_PLACEHOLDER:
+            raise ValueError(f"Prompt {self.name} has no {PLACEHOLDER} placeholder ({self.path})")
+        self.text = text
+        self.parts = parts
+        self.mtime = mtime
+
+    def render(self, text=""):
+        """Sostituisce ogni {{text}} con il testo indicato."""
+        return text.join(self.parts)
+
+    def __str__(self):
+        return self.text
+
+
+class PromptRegistry:
+    def __init__(self, base_dir=BASE_DIR, dirs=PROMPT_DIRS, hot_reload=False, check_interval=CHECK_INTERVAL):
+        self.base_dir = base_dir
+        self.dirs = dirs
+        self.hot_reload = hot_reload
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._templates = {}
+        self._rejected = {}
+        for directory in dirs:
+            path = os.path.join(base_dir, directory)
+            if not os.path.isdir(path):
+                raise FileNotFoundError(f"Prompt directory {path} not found")
+            for file_name in sorted(os.listdir(path)):
+                file_path = os.path.join(path, file_name)
+                if os.path.isfile(file_path) and not file_name.startswith("."):
+                    name = f"{directory}/{file_name}"
+                    self._templates[name] = PromptTemplate(name, file_path)
+
+    def _reload_changed(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        for template in self._templates.values():
+            try:
+                mtime = os.path.getmtime(template.path)
+            except OSError:
+                mtime = None
+            if mtime == template.mtime or (template.name in self._rejected and self._rejected[template.name] == mtime):
+                continue
+            try:
+                template.load()
+                self._rejected.pop(template.name, None)
+                self.reloads += 1
+                print(f"[PROMPTS] Reloaded {template.name}")
+            except (OSError, ValueError) as e:
+                # si continua con la versione gia' caricata finche' il file non cambia di nuovo
+                self._rejected[template.name] = mtime
+                print(f"[PROMPTS] Keeping the loaded {template.name}: {e}")
+
+    def get(self, name):
+        """Template con il nome indicato (es. "prompt/fullagent", "techniques_prompts/3"), None se non esiste."""
+        if self.hot_reload:
+            with self._lock:
+                self._reload_changed()
+        return self._templates.get(name)
+
+    def text(self, name):
+        template = self.get(name)
+        if template is None:
+            raise KeyError(f"Unknown prompt {name!r}")
+        return template.text
+
+    def render(self, name, text=""):
+        template = self.get(name)
+        if template is None:
+            raise KeyError(f"Unknown prompt {name!r}")
+        return template.render(text)
+
+    def names(self):
+        return sorted(self._templates)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def load_prompts(base_dir=BASE_DIR, hot_reload=False):
+    """Carica (o ricarica) il registro condiviso; gli errori di validazione emergono qui, all'avvio."""
+    global _registry
+    registry = PromptRegistry(base_dir=base_dir, hot_reload=hot_reload)
+    with _registry_lock:
+        _registry = registry
+    return registry
+
+
+def get_registry():
+    """Registro condiviso, caricato al primo utilizzo se load_prompts non e' stato chiamato."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PromptRegistry()
+        return _registry
@@ -1,19 +1,20 @@
 import json
 from valid import *
-from agents import user_proxy, NarrativeModifier
+from agents import user_proxy, chat, NarrativeModifier
+from prompts import get_registry
 
-def apply_propaganda_technique(text, index, round_count):
+def apply_propaganda_technique(text, index, round_count, agent=NarrativeModifier):
     """
     Chiede all'agente NarrativeModifier di scegliere una tecnica e applicarla usando il prompt specifico.
     """
     newspaper_name = "BBC News, Reuters, The Guardian, The New York Times"
     newspaper_url = "https://www.bbc.com, https://www.reuters.com, https://www.theguardian.com, https://www.nytimes.com"
 
-    with open("prompt/promptpropaganda", "r") as f:
-        selection_prompt = f.read()
+    prompts = get_registry()
+    selection_prompt = prompts.text("prompt/promptpropaganda")
 
     message = f"Instructions:\n{selection_prompt}\nFollow the journalistic style of {newspaper_name} {newspaper_url}\nText:\n{text}"
-    response = user_proxy.initiate_chat(NarrativeModifier, message=message)
+    response = chat(agent, message)
     log_agent_response(index, "NarrativeModifier", message, response.summary, round_count)
 
     try:
@@ -22,18 +23,16 @@ def apply_propaganda_technique(text, index, round_count):
     except (json.JSONDecodeError, TypeError):
         technique_number = 1  #default di sicurezza
 
-    #Carica il prompt specifico per la tecnica scelta
-    try:
-        with open(f"techniques_prompts/{technique_number}", "r", encoding= "utf-8") as f:
-            technique_prompt = f.read()
-    except FileNotFoundError:
-        return text 
+    #prompt specifico per la tecnica scelta (gia' caricato dal registro)
+    technique_prompt = prompts.get(f"techniques_prompts/{technique_number}")
+    if technique_prompt is None:
+        return text
 
     #Invio il prompt dettagliato
     #response = user_proxy.initiate_chat(NarrativeModifier, message=f"{technique_prompt}\n\nOriginal Text:\n{text}")
-    message = technique_prompt.replace("{{text}}", text)
-    response = user_proxy.initiate_chat(NarrativeModifier, message=message)
-    parsed_prop = valid_modifiedtext(response.summary,NarrativeModifier, original_text=text)  # fallback se fallisce
+    message = technique_prompt.render(text)
+    response = chat(agent, message)
+    parsed_prop = valid_modifiedtext(response.summary, agent, original_text=text)  # fallback se fallisce
 
     response_to_log = response.summary if isinstance(parsed_prop, str) else json.dumps(parsed_prop)
     log_agent_response(index, "NarrativeModifier", message, response_to_log, round_count)
@@ -0,0 +1,99 @@
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from dataset import metrics_path_for, is_scored_row, output_row_indices
+from evaluation import lexical_metrics, bert_score_batch
+
+# Ricalcola i file metrics/*.csv a partire da output_files/output*.csv, senza rieseguire gli agenti LLM.
+# BLEU, ROUGE e readability vengono calcolati in un pool di processi, BERTScore in batch nel processo principale.
+
+METRIC_HEADER = [
+    "index",
+    "initial_bleu", "initial_rouge1", "initial_rouge2", "initial_rougeL", "initial_readability", "initial_bert_score",
+    "final_bleu", "final_rouge1", "final_rouge2", "final_rougeL", "final_readability", "final_bert_score"
+]
+
+
+def _lexical_job(job):
+    original_text, candidates = job
+    return [lexical_metrics(original_text, candidate) for candidate in candidates]
+
+
+def metric_values(metrics):
+    return [
+        metrics["bleu"],
+        metrics["rouge"]["rouge1"],
+        metrics["rouge"]["rouge2"],
+        metrics["rouge"]["rougeL"],
+        metrics["readability"],
+        metrics["bert_score"],
+    ]
+
+
+def recompute_file(pool, input_path, output_path, chunksize=256, batch_size=64, metrics_dir="metrics"):
+    rows_written = 0
+    header = pd.read_csv(input_path, nrows=0).columns
+    # senza colonna index gli indici vengono dal file di metriche originale (non dalla posizione:
+    # main.py numera gli articoli dalla loro posizione nel dataset, es. da 3100)
+    row_indices = output_row_indices(input_path, metrics_dir) if "index" not in header else None
+    position = 0
+    with open(output_path, mode="w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(METRIC_HEADER)
+
+        for chunk in pd.read_csv(input_path, chunksize=chunksize, dtype=str, keep_default_na=False):
+            rows = [
+                (
+                    row["index"] if row_indices is None else row_indices[position + n],
+                    row["original_text"], row["modified_text_1"] or row["modified_text"], row["modified_text"]
+                )
+                for n, (_, row) in enumerate(chunk.iterrows())
+                if is_scored_row(row)
+            ]
+            position += len(chunk)
+            if not rows:
+                continue
+
+            jobs = [(original, [initial, final]) for _, original, initial, final in rows]
+            lexical = list(pool.map(_lexical_job, jobs, chunksize=8))
+
+            pairs = []
+            for _, original, initial, final in rows:
+                pairs.extend([(original, initial), (original, final)])
+            bert_scores = bert_score_batch(pairs, batch_size=batch_size)
+
+            for n, (index, _, _, _) in enumerate(rows):
+                initial_metrics, final_metrics = lexical[n]
+                initial_metrics["bert_score"] = bert_scores[2 * n]
+                final_metrics["bert_score"] = bert_scores[2 * n + 1]
+                writer.writerow([index] + metric_values(initial_metrics) + metric_values(final_metrics))
+            rows_written += len(rows)
+    return rows_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute the metrics files from the generated output files")
+    parser.add_argument("--input", type=str, default="output_files/output*.csv", help="Glob of the output CSV files")
+    parser.add_argument("--output-dir", type=str, default="metrics/recomputed", help="Directory for the recomputed metrics files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for BLEU, ROUGE and readability")
+    parser.add_argument("--batch-size", type=int, default=64, help="Sentences per BERTScore batch")
+    parser.add_argument("--chunksize", type=int, default=256, help="Number of CSV rows read at a time")
+    parser.add_argument("--metrics-dir", type=str, default="metrics", help="Original metrics files, used for the article indices of output files without an 'index' column")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for input_path in sorted(glob.glob(args.input)):
+            output_path = metrics_path_for(input_path, args.output_dir)
+            try:
+                rows = recompute_file(
+                    pool, input_path, output_path,
+                    chunksize=args.chunksize, batch_size=args.batch_size, metrics_dir=args.metrics_dir
+                )
+            except ValueError as e:
+                raise SystemExit(str(e))
+            print(f"[METRICS] {input_path} -> {output_path} ({rows} rows)")
@@ -0,0 +1,57 @@
+import argparse
+import glob
+import os
+import pandas as pd
+from detector import FakeNewsDetector, format_label_score
+
+# Ricalcola initial_label_score / final_label_score dei file output_files/*.csv
+# passando i testi al detector BERT in batch, senza rieseguire la pipeline LLM.
+
+LABEL_COLUMNS = {
+    "modified_text_1": "initial_label_score",
+    "modified_text": "final_label_score",
+}
+
+
+def relabel_chunk(detector, chunk):
+    for text_column, label_column in LABEL_COLUMNS.items():
+        if text_column not in chunk.columns:
+            continue
+        texts = chunk[text_column].fillna("").astype(str)
+        mask = texts.str.strip() != ""
+        if not mask.any():
+            continue
+        results = detector.predict_batch(texts[mask].tolist())
+        chunk.loc[mask, label_column] = [format_label_score(label, probs) for label, probs in results]
+    return chunk
+
+
+def relabel_file(detector, input_path, output_path, chunksize=256):
+    rows = 0
+    header = True
+    with open(output_path, mode="w", newline="", encoding="utf-8") as f:
+        for chunk in pd.read_csv(input_path, chunksize=chunksize, dtype=str, keep_default_na=False):
+            chunk = relabel_chunk(detector, chunk)
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+            rows += len(chunk)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-label output CSV files with the BERT detector")
+    parser.add_argument("--input", type=str, default="output_files/*.csv", help="Glob of the output CSV files to re-label")
+    parser.add_argument("--output-dir", type=str, default="output_files/relabel", help="Directory for the re-labelled CSV files")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of chunks per BERT forward pass")
+    parser.add_argument("--chunksize", type=int, default=256, help="Number of CSV rows read at a time")
+    args = parser.parse_args()
+
+    detector = FakeNewsDetector(method="bert", batch_size=args.batch_size)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    for input_path in sorted(glob.glob(args.input)):
+        output_path = os.path.join(args.output_dir, os.path.basename(input_path))
+        if os.path.abspath(output_path) == os.path.abspath(input_path):
+            continue
+        rows = relabel_file(detector, input_path, output_path, chunksize=args.chunksize)
+        print(f"[RELABEL] {input_path} -> {output_path} ({rows} rows)")
@@ -0,0 +1,216 @@
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+from writers import BackgroundWriter
+
+# Archivio SQLite (WAL) di un'esecuzione di main.py: articoli, metriche, round, chiamate agli
+# agenti e tempi in tabelle indicizzate, collegate da (variant, idx). Gli inserimenti passano
+# da un thread in background e vengono eseguiti a blocchi, una transazione per blocco.
+# "python runstore.py --db ... --output-dir ..." ricostruisce i CSV di main.py.
+
+METRIC_COLUMNS = [
+    "initial_bleu", "initial_rouge1", "initial_rouge2", "initial_rougeL", "initial_readability", "initial_bert_score",
+    "final_bleu", "final_rouge1", "final_rouge2", "final_rougeL", "final_readability", "final_bert_score"
+]
+OUTPUT_COLUMNS = [
+    "original_title", "original_text", "modified_text_1", "modified_title", "modified_text",
+    "initial_label_score", "final_label_score", "error"
+]
+ROUND_COLUMNS = ["round", "label", "fake_score", "real_score", "bleu", "rouge1", "rouge2", "rougeL", "readability", "bert_score"]
+AGENT_CALL_COLUMNS = ["agent_name", "input_message", "response_text", "round", "shap_explanation"]
+TIMING_COLUMNS = [
+    "SemanticAnalyzer", "SalientSentenceEditor", "NarrativeModifier", "NumberModifier",
+    "TitleEditor", "Detector", "EvaluatorAgent", "SalientTextRewriter", "UniversalAgent",
+    "EvaluatorAgent_Total", "total_execution_time"
+]
+
+TABLES = {
+    "articles": OUTPUT_COLUMNS,
+    "metrics": METRIC_COLUMNS,
+    "rounds": ROUND_COLUMNS,
+    "agent_calls": AGENT_CALL_COLUMNS,
+    "timings": TIMING_COLUMNS,
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS articles_idx ON articles (variant, idx)",
+    "CREATE INDEX IF NOT EXISTS articles_error ON articles (error) WHERE error != ''",
+    "CREATE INDEX IF NOT EXISTS metrics_idx ON metrics (variant, idx)",
+    "CREATE INDEX IF NOT EXISTS rounds_idx ON rounds (variant, idx, round)",
+    "CREATE INDEX IF NOT EXISTS rounds_label ON rounds (round, label)",
+    "CREATE INDEX IF NOT EXISTS agent_calls_idx ON agent_calls (variant, idx)",
+    "CREATE INDEX IF NOT EXISTS agent_calls_agent ON agent_calls (agent_name, round)",
+    "CREATE INDEX IF NOT EXISTS timings_idx ON timings (variant, idx)",
+]
+
+
+def variant_file_names(variant):
+    """(file delle metriche, file di output) della variante, come in main.py."""
+    if variant == "full":
+        return "full_metric.csv", "output_full.csv"
+    if variant.startswith("no_"):
+        return f"metric_{variant}.csv", f"output_{variant}.csv"
+    return "metric.csv", "output.csv"
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def create_schema(conn):
+    for table, columns in TABLES.items():
+        column_defs = ", ".join(f'"{column}"' for column in columns)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, variant TEXT NOT NULL, idx INTEGER NOT NULL, {column_defs})"
+        )
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.commit()
+
+
+def _insert_sql(table):
+    columns = ["variant", "idx"] + TABLES[table]
+    names = ", ".join(f'"{column}"' for column in columns)
+    return f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))})"
+
+
+class _SQLiteWriter(BackgroundWriter):
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self._conn = None
+        super().__init__(path, **kwargs)
+
+    def _open(self):
+        self._conn = connect(self.path)
+
+    def _write_batch(self, batch):
+        by_table = {}
+        for table, values in batch:
+            by_table.setdefault(table, []).append(values)
+        with self._conn:
+            for table, rows in by_table.items():
+                self._conn.executemany(_insert_sql(table), rows)
+
+    def _close(self):
+        self._conn.close()
+
+
+class RunStore:
+    """
+    Sink SQLite opzionale per main.py (--run-store). La variante corrente e' per thread
+    (set_variant), cosi' le chiamate agli agenti registrate da valid.log_agent_response
+    vengono attribuite alla variante in esecuzione in quel thread.
+    """
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = connect(path)
+        create_schema(conn)
+        conn.close()
+        self.path = path
+        self._local = threading.local()
+        self._writer = _SQLiteWriter(path)
+
+    def set_variant(self, variant):
+        self._local.variant = variant
+
+    @property
+    def variant(self):
+        return getattr(self._local, "variant", "")
+
+    def _add(self, table, variant, idx, values):
+        self._writer.write((table, (variant, idx, *values)))
+
+    def add_article(self, variant, row):
+        self._add("articles", variant, row["index"], [row.get(column, "") for column in OUTPUT_COLUMNS])
+
+    def add_metrics(self, variant, row):
+        """row: riga del file delle metriche (indice seguito dai valori di METRIC_COLUMNS)."""
+        self._add("metrics", variant, row[0], row[1:])
+
+    def add_round(self, variant, idx, round_count, label, probs, metrics):
+        self._add("rounds", variant, idx, [
+            round_count, label, float(probs[1]), float(probs[0]),
+            metrics["bleu"], metrics["rouge"]["rouge1"], metrics["rouge"]["rouge2"], metrics["rouge"]["rougeL"],
+            metrics["readability"], metrics["bert_score"],
+        ])
+
+    def add_agent_call(self, idx, agent_name, input_message, response_text, round_count, shap_explanation):
+        self._add("agent_calls", self.variant, idx, [agent_name, input_message, response_text, round_count, shap_explanation])
+
+    def add_timing(self, variant, header, row):
+        values = dict(zip(header, row))
+        self._add("timings", variant, values["index"], [values.get(column, 0.0) for column in TIMING_COLUMNS])
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+    def stats(self):
+        return self._writer.stats()
+
+
+def export_csv(db_path, output_dir):
+    """Ricostruisce metrics/, output_files/, agent_logs/ e times/ nell'ordine di inserimento."""
+    conn = connect(db_path)
+    written = {}
+
+    def write(path, header, rows):
+        path = os.path.join(output_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode="w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            count = 0
+            for row in rows:
+                writer.writerow(["" if value is None else value for value in row])
+                count += 1
+        written[path] = count
+
+    variants = [row[0] for row in conn.execute(
+        "SELECT variant FROM (SELECT variant, MIN(id) AS first FROM articles GROUP BY variant "
+        "UNION ALL SELECT variant, MIN(id) FROM metrics GROUP BY variant) GROUP BY variant ORDER BY MIN(first)"
+    )]
+    for variant in variants:
+        metric_name, output_name = variant_file_names(variant)
+        write(
+            os.path.join("metrics", metric_name),
+            ["index"] + METRIC_COLUMNS,
+            conn.execute(f"SELECT idx, {', '.join(METRIC_COLUMNS)} FROM metrics WHERE variant = ? ORDER BY id", (variant,)),
+        )
+        write(
+            os.path.join("output_files", output_name),
+            ["index"] + OUTPUT_COLUMNS,
+            conn.execute(f"SELECT idx, {', '.join(OUTPUT_COLUMNS)} FROM articles WHERE variant = ? ORDER BY id", (variant,)),
+        )
+
+    write(
+        os.path.join("agent_logs", "agent_responses.csv"),
+        ["index"] + AGENT_CALL_COLUMNS,
+        conn.execute(f"SELECT idx, {', '.join(AGENT_CALL_COLUMNS)} FROM agent_calls ORDER BY id"),
+    )
+    write(
+        os.path.join("times", "time.csv"),
+        ["index"] + TIMING_COLUMNS,
+        conn.execute(f"SELECT idx, {', '.join(TIMING_COLUMNS)} FROM timings ORDER BY id"),
+    )
+    conn.close()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a main.py --run-store database to the usual CSV files")
+    parser.add_argument("--db", type=str, required=True, help="SQLite file written by main.py --run-store")
+    parser.add_argument("--output-dir", type=str, default="exported", help="Directory for metrics/, output_files/, agent_logs/ and times/")
+    args = parser.parse_args()
+
+    for path, rows in export_csv(args.db, args.output_dir).items():
+        print(f"{path}: {rows} rows")
@@ -0,0 +1,34 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Tempi di import e di caricamento dei modelli, per rendere visibili le regressioni all'avvio.
+STARTUP_TIMES = {}
+# fasi non annidate in un altro load_timer: solo queste entrano nel totale
+TOP_LEVEL = set()
+_depth = threading.local()
+
+
+@contextmanager
+def load_timer(name):
+    depth = getattr(_depth, "value", 0)
+    if depth == 0:
+        TOP_LEVEL.add(name)
+    _depth.value = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _depth.value = depth
+        STARTUP_TIMES[name] = STARTUP_TIMES.get(name, 0.0) + time.perf_counter() - start
+
+
+def startup_report():
+    """Tempi per fase; le fasi annidate sono rientrate e non contano nel totale."""
+    lines = ["[STARTUP] import/load times:"]
+    for name, seconds in sorted(STARTUP_TIMES.items(), key=lambda x: -x[1]):
+        label = name if name in TOP_LEVEL else f"  {name}"
+        lines.append(f"  {label:<32} {seconds:8.2f}s")
+    total = sum(seconds for name, seconds in STARTUP_TIMES.items() if name in TOP_LEVEL)
+    lines.append(f"  {'total':<32} {total:8.2f}s")
+    return "\n".join(lines)
@@ -0,0 +1,21 @@
+from cache import DiskCache
+
+# Cache su disco limitata dai byte dei valori: le risposte lunghe contano piu' di quelle brevi.
+
+
+def test_disk_cache_evicts_by_bytes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = DiskCache(path, max_entries=None, max_bytes=3000)
+    cache.set("short-1", "x" * 100)
+    cache.set("long", "y" * 2000)
+    cache.set("short-2", "z" * 100)
+    assert cache.get("short-1") is not None     # usata di recente: resta
+    cache.set("long-2", "w" * 1500)
+    assert cache.get("long") is None
+    assert cache.get("short-1") == "x" * 100
+    assert cache.stats()["bytes"] <= 3000
+    cache.close()
+
+    reopened = DiskCache(path, max_entries=None, max_bytes=3000)
+    assert reopened.stats()["bytes"] == sum(len(f'"{v}"') for v in ("x" * 100, "z" * 100, "w" * 1500))
+    reopened.close()
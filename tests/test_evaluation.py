@@ -0,0 +1,87 @@
+import pytest
+from nltk.translate.bleu_score import sentence_bleu
+import evaluation
+from evaluation import PreparedReference, _bleu, _rouge
+
+# Parita' delle metriche con n-gram precalcolati rispetto alle implementazioni di riferimento.
+
+PAIRS = [
+    (
+        "The minister announced on Monday that the new budget will cut taxes for 2 million families.",
+        "On Monday the minister said the new budget would cut taxes for about 2 million families.",
+    ),
+    (
+        "Scientists found water ice near the lunar south pole, NASA said in a statement.",
+        "NASA said scientists had found large amounts of water ice near the Moon's south pole.",
+    ),
+    ("Short text.", "A completely different and much longer sentence about another topic entirely."),
+    ("Identical text, repeated twice. Identical text, repeated twice.", "Identical text, repeated twice. Identical text, repeated twice."),
+    ("One two three", "One two"),
+    ("Nothing in common here", "Zebras quietly graze"),
+]
+
+
+@pytest.mark.parametrize("original, modified", PAIRS)
+def test_bleu_matches_sentence_bleu(original, modified):
+    expected = sentence_bleu([original.split()], modified.split())
+    assert _bleu(PreparedReference(original), modified.split()) == pytest.approx(expected, abs=1e-12)
+
+
+@pytest.mark.parametrize("original, modified", PAIRS)
+def test_rouge_matches_rouge_scorer(original, modified):
+    expected = evaluation.get_rouge_scorer().score(original, modified)
+    scores = _rouge(PreparedReference(original), modified)
+    for name in ("rouge1", "rouge2", "rougeL"):
+        assert scores[name].precision == pytest.approx(expected[name].precision, abs=1e-12)
+        assert scores[name].recall == pytest.approx(expected[name].recall, abs=1e-12)
+        assert scores[name].fmeasure == pytest.approx(expected[name].fmeasure, abs=1e-12)
+
+
+def test_bert_f1_matches_bert_scorer():
+    try:
+        scorer = evaluation.get_bert_scorer()
+    except Exception as e:
+        pytest.skip(f"BERTScore model not available: {e}")
+    originals = [original for original, _ in PAIRS]
+    modified = [text for _, text in PAIRS]
+    _, _, expected = scorer.score(modified, originals)
+
+    prepared = evaluation.bert_score_batch([(PreparedReference(o), m) for o, m in PAIRS], batch_size=4)
+    plain = evaluation.bert_score_batch(list(zip(originals, modified)), batch_size=4)
+    assert prepared == pytest.approx(expected.tolist(), abs=1e-5)
+    assert plain == pytest.approx(expected.tolist(), abs=1e-5)
+
+
+def test_reference_cache_bounded_by_size(tmp_path):
+    torch = pytest.importorskip("torch")
+    reference = PreparedReference("Some original article text. " * 20)
+    reference.bert_model = "test-model"
+    reference.bert_stats = (torch.ones(50, 16), torch.ones(50))
+    path = tmp_path / "reference.pt"
+    reference.save(path)
+
+    loaded = PreparedReference.load(path)
+    assert loaded.text == reference.text
+    assert loaded.bleu_ngrams == reference.bleu_ngrams
+    assert torch.equal(loaded.bert_stats[0], reference.bert_stats[0])
+
+    cache = evaluation.SizedLRUCache(max_size=reference.nbytes() * 2.5, sizeof=lambda r: r.nbytes())
+    for key in "abcd":
+        cache.set(key, reference)
+    assert len(cache) == 2
+    assert cache.size <= cache.max_size
+
+
+def test_truncated_reference_file_is_rebuilt(tmp_path, monkeypatch):
+    pytest.importorskip("torch")
+    monkeypatch.setattr(evaluation, "_bert_reference_stats", lambda references, batch_size: None)
+    text = "A truncated cache file must not fail the article. " * 10
+    path = tmp_path / f"{evaluation.text_key(text)}.pt"
+    PreparedReference(text).save(path)
+    path.write_bytes(path.read_bytes()[:40])
+    evaluation._reference_cache.clear()
+
+    reference = evaluation.prepare_reference(text, cache_dir=str(tmp_path))
+    assert reference.text == text
+    assert PreparedReference.load(path).text == text
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
@@ -0,0 +1,88 @@
+import asyncio
+import random
+import time
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("openai")
+from llm_client import AdaptiveLimiter, EndpointPool, LIMIT_INITIAL, estimate_tokens, trim_messages
+
+# Limite di contesto: si eliminano solo i tentativi intermedi, mai il compito ne' l'ultimo messaggio.
+
+SYSTEM = {"role": "system", "content": "s" * 400}
+TASK = {"role": "user", "content": "Rewrite this article: " + "t" * 4000}
+
+
+def conversation(retries=3):
+    messages = [SYSTEM, TASK]
+    for k in range(retries):
+        messages.append({"role": "assistant", "content": f"invalid reply {k} " + "x" * 800})
+        messages.append({"role": "user", "content": f"The format is incorrect ({k})."})
+    return messages
+
+
+def test_within_budget_is_unchanged():
+    messages = conversation()
+    assert trim_messages(messages, estimate_tokens(messages)) is messages
+
+
+def test_drops_oldest_retries_and_keeps_task_whole():
+    messages = conversation()
+    trimmed = trim_messages(messages, estimate_tokens(messages) - 100)
+    assert trimmed[:2] == [SYSTEM, TASK]
+    assert trimmed[-1] == messages[-1]
+    assert [m["content"] for m in trimmed[2:]] == [m["content"] for m in messages[4:]]
+
+
+def test_task_over_budget_raises():
+    with pytest.raises(ValueError):
+        trim_messages(conversation(), estimate_tokens([SYSTEM, TASK]))
+
+
+# Limite adattivo: con carico del server costante la latenza dipende solo dalla dimensione della
+# richiesta (lettura del prompt + token generati); risposte brevi e lunghe mescolate non devono ridurlo.
+
+PREFILL_SECONDS = 0.0004    # per token di prompt
+DECODE_SECONDS = 0.02       # per token generato
+
+
+def served(limiter, rnd, prompt_tokens, completion_tokens, load=1.0):
+    latency = load * (PREFILL_SECONDS * prompt_tokens + DECODE_SECONDS * completion_tokens) * rnd.uniform(0.9, 1.1)
+    # richiesta a limite raggiunto: conta per l'aumento
+    limiter.in_flight = int(limiter.limit)
+    limiter.release(time.perf_counter(), latency=latency, tokens=completion_tokens, prompt_tokens=prompt_tokens)
+
+
+def test_limit_does_not_collapse_with_short_and_long_replies():
+    limiter = AdaptiveLimiter()
+    rnd = random.Random(0)
+    for n in range(600):
+        if n % 4 == 0:
+            served(limiter, rnd, rnd.randint(1200, 2000), rnd.randint(400, 800))    # riscrittura dell'articolo
+        else:
+            served(limiter, rnd, rnd.randint(1200, 2000), rnd.randint(10, 60))      # feedback, titolo, JSON
+    assert limiter.limit >= LIMIT_INITIAL
+
+
+def test_limit_drops_when_latency_rises():
+    limiter = AdaptiveLimiter()
+    rnd = random.Random(0)
+    for _ in range(200):
+        served(limiter, rnd, 1500, 40)
+    before = limiter.limit
+    for _ in range(5):
+        served(limiter, rnd, 1500, 40, load=3.0)
+    assert limiter.limit < before
+
+
+def test_empty_config_list_is_rejected():
+    with pytest.raises(ValueError):
+        EndpointPool([])
+
+
+def test_pool_without_endpoints_raises_a_clear_error():
+    pool = EndpointPool([{"model": "llama3", "base_url": "http://localhost:1/v1"}])
+    pool.endpoints = []
+    pool._start_health_checks = lambda: None
+    with pytest.raises(RuntimeError, match="no LLM endpoint"):
+        asyncio.run(pool.create({"messages": []}))
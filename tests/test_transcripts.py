@@ -0,0 +1,129 @@
+import json
+import random
+import sqlite3
+import pytest
+from transcripts import TranscriptStore, split_chunks, AVG_CHUNK, MAX_CHUNK
+
+# Deduplicazione dell'archivio dei log: lo stesso articolo ripetuto nei messaggi di N agenti
+# deve occupare circa lo spazio di un articolo, anche dopo prefissi diversi e su una sola riga.
+
+N_TRANSCRIPTS = 40
+PROMPTS = [
+    "You are a semantic modifier. Rewrite the text below keeping its meaning.\n\n",
+    "Find the most salient sentence of the following article and return it as JSON.\n\n",
+    "Rewrite the narrative of the article. Respond with JSON only.\n\n",
+    "Change the numbers in the text. ",
+]
+
+
+def make_article(seed=7, words=1200):
+    rnd = random.Random(seed)
+    vocabulary = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 9))) for _ in range(3000)]
+    sentences = []
+    while sum(len(s) for s in sentences) < words * 6:
+        sentences.append(" ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(8, 25))).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def transcript(k, article):
+    # prompt di uno degli agenti seguito dall'articolo, a righe o su una riga dentro un JSON
+    prompt = PROMPTS[k % len(PROMPTS)]
+    if k % 2:
+        return prompt + json.dumps({"text": article})
+    return prompt + article.replace(". ", ".\n")
+
+
+def test_split_chunks_roundtrip_and_bounds():
+    data = make_article().encode("utf-8") * 3
+    chunks = split_chunks(data)
+    assert b"".join(chunks) == data
+    assert max(len(chunk) for chunk in chunks) <= MAX_CHUNK
+    assert split_chunks(b"") == [b""]
+
+
+def test_cut_points_resynchronize_after_a_different_prefix():
+    data = make_article().encode("utf-8")
+    plain = set(split_chunks(data))
+    shifted = split_chunks(b"some other prompt, any length: " + data)
+    shared = sum(len(chunk) for chunk in shifted if chunk in plain)
+    assert shared >= len(data) - 2 * MAX_CHUNK
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TranscriptStore(str(tmp_path / "transcripts.db"))
+    yield store
+    store.close()
+
+
+def write_transcripts(store, messages):
+    for k, message in enumerate(messages):
+        store.write({
+            "index": 3100, "agent_name": f"Agent{k % len(PROMPTS)}", "input_message": message,
+            "response_text": '{"modified_text": "ok"}', "round": k // len(PROMPTS), "shap_explanation": "",
+        })
+    store.flush()
+
+
+def test_unique_bytes_stay_near_one_article(store):
+    article = make_article()
+    one_copy = len(article.encode("utf-8")) + len(json.dumps({"text": article}).encode("utf-8"))
+    messages = [transcript(k, article) for k in range(N_TRANSCRIPTS)]
+    write_transcripts(store, messages)
+
+    report = store.size_report()
+    assert report["text_bytes"] >= N_TRANSCRIPTS * one_copy / 2
+    # una copia per formato (testo a righe e JSON), piu' i prompt e un blocco di confine per prompt
+    assert report["unique_bytes"] < 1.25 * one_copy
+    assert [row["input_message"] for row in store.rows(index=3100)] == messages
+
+
+def test_each_distinct_prefix_costs_about_one_chunk(store):
+    article = json.dumps({"text": make_article()})
+    messages = [f"[call {k}] " + article for k in range(N_TRANSCRIPTS)]
+    write_transcripts(store, messages)
+
+    report = store.size_report()
+    assert report["unique_bytes"] < len(article) + N_TRANSCRIPTS * 3 * AVG_CHUNK
+
+
+def test_new_chunks_are_compressed_together(store):
+    article = make_article()
+    write_transcripts(store, [transcript(k, article) for k in range(N_TRANSCRIPTS)])
+    # un blocco compresso da solo resta intorno ai due terzi: insieme si scende sotto la meta'
+    assert store.size_report()["compression_ratio"] < 0.5
+
+
+class _FailingConnection:
+    """Connessione che fallisce all'inserimento delle righe, dopo quello dei pacchetti."""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def executemany(self, sql, rows):
+        if sql.startswith("INSERT INTO transcripts"):
+            raise sqlite3.OperationalError("disk I/O error")
+        return self._conn.executemany(sql, rows)
+
+
+def test_chunks_of_a_failed_batch_are_written_again(store):
+    message = transcript(1, make_article())
+    writer = store._writer
+    writer._conn = _FailingConnection(writer._conn)
+    store.write({"index": 1, "agent_name": "A", "input_message": message, "response_text": "", "round": 0, "shap_explanation": ""})
+    with pytest.raises(RuntimeError):
+        store.flush()
+
+    writer._conn = writer._conn._conn
+    writer.error = None
+    store.write({"index": 1, "agent_name": "A", "input_message": message, "response_text": "", "round": 0, "shap_explanation": ""})
+    store.flush()
+    assert [row["input_message"] for row in store.rows(index=1)] == [message]
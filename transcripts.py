@@ -0,0 +1,351 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import zlib
+from cache import LRUCache
+from writers import BackgroundWriter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Archivio delle risposte degli agenti con testi deduplicati: ogni testo (messaggio in ingresso,
+# risposta) viene diviso in blocchi con content-defined chunking, ogni blocco distinto e' salvato
+# una sola volta e indicizzato dal suo hash. I blocchi nuovi di ogni batch sono compressi insieme
+# (un blocco da solo, circa 512 byte, si comprime poco). Le righe del log contengono solo la lista
+# degli hash: il testo dell'articolo, ripetuto nei messaggi di tutti gli agenti, occupa spazio una volta.
+# "python transcripts.py --db ... --output ..." ricostruisce agent_responses.csv.
+#
+# I tagli dei blocchi dipendono solo dai byte vicini (gear hash a finestra mobile, come FastCDC):
+# lo stesso testo produce gli stessi blocchi anche se preceduto da un prompt diverso, su una sola
+# riga o dentro un JSON, e dopo un prefisso diverso i tagli si riallineano entro un blocco.
+
+MIN_CHUNK = 128     # byte minimi di un blocco (salvo l'ultimo)
+AVG_CHUNK = 512     # dimensione media attesa, potenza di 2
+MAX_CHUNK = 4096    # un blocco viene tagliato comunque a questa dimensione
+ZSTD_LEVEL = 10
+PACK_SIZE = 256 * 1024  # byte dei blocchi nuovi compressi insieme in un pacchetto
+READ_CACHE_SIZE = 4096  # blocchi tenuti in memoria durante la lettura
+PACK_CACHE_SIZE = 16    # pacchetti decompressi tenuti in memoria durante la lettura
+
+FIELDNAMES = ["index", "agent_name", "input_message", "response_text", "round", "shap_explanation"]
+
+# tabella del gear hash: 256 valori a 64 bit fissi, i tagli devono essere gli stessi tra esecuzioni
+GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "little") for i in range(256))
+MASK64 = (1 << 64) - 1
+
+
+def _masks(avg_chunk):
+    # chunking normalizzato: prima della dimensione media servono piu' bit a zero (taglio meno probabile),
+    # dopo ne servono meno; si usano i bit alti, che dipendono dagli ultimi 64 byte
+    bits = avg_chunk.bit_length() - 1
+    strict = ((1 << (bits + 1)) - 1) << (64 - bits - 1)
+    loose = ((1 << (bits - 1)) - 1) << (64 - bits + 1)
+    return strict, loose
+
+
+def split_chunks(data, min_chunk=MIN_CHUNK, avg_chunk=AVG_CHUNK, max_chunk=MAX_CHUNK):
+    """Divide i byte in blocchi con tagli definiti dal contenuto (gear hash); la concatenazione ridà data."""
+    strict, loose = _masks(avg_chunk)
+    chunks = []
+    start = 0
+    length = len(data)
+    while length - start > min_chunk:
+        end = min(start + max_chunk, length)
+        middle = min(start + avg_chunk, end)
+        h = 0
+        cut = end
+        i = start + min_chunk
+        while i < middle:
+            h = ((h << 1) + GEAR[data[i]]) & MASK64
+            i += 1
+            if not h & strict:
+                cut = i
+                break
+        else:
+            while i < end:
+                h = ((h << 1) + GEAR[data[i]]) & MASK64
+                i += 1
+                if not h & loose:
+                    cut = i
+                    break
+        chunks.append(data[start:cut])
+        start = cut
+    if start < length or not chunks:
+        chunks.append(data[start:])
+    return chunks
+
+
+def chunk_key(chunk):
+    return hashlib.sha256(chunk).hexdigest()
+
+
+def compress(data):
+    """(codec, dati compressi): zstd se il pacchetto zstandard e' installato, altrimenti zlib."""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+
+def decompress(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("L'archivio contiene blocchi zstd: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # i blocchi nuovi di un batch sono compressi insieme in un pacchetto (packs); chunks dice
+    # in quale pacchetto e a quale offset si trova ogni blocco
+    conn.execute("CREATE TABLE IF NOT EXISTS packs (id INTEGER PRIMARY KEY, codec TEXT NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, pack INTEGER NOT NULL, offset INTEGER NOT NULL, size INTEGER NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS transcripts (id INTEGER PRIMARY KEY, idx INTEGER NOT NULL, agent_name TEXT NOT NULL, "
+        "input_chunks TEXT NOT NULL, response_chunks TEXT NOT NULL, round INTEGER, shap_explanation TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS transcripts_idx ON transcripts (idx, round)")
+    conn.execute("CREATE INDEX IF NOT EXISTS transcripts_agent ON transcripts (agent_name)")
+    conn.commit()
+    return conn
+
+
+def _has_legacy_blobs(conn):
+    # archivi scritti prima dei pacchetti: un blocco compresso per riga nella tabella blobs
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blobs'").fetchone() is not None
+
+
+class _TranscriptWriter(BackgroundWriter):
+    """Divisione in blocchi, hash e compressione avvengono nel thread del writer."""
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self._conn = None
+        self._known = set()
+        self.raw_bytes = 0
+        self.new_bytes = 0
+        super().__init__(path, **kwargs)
+
+    def _open(self):
+        self._conn = connect(self.path)
+        self._known = {row[0] for row in self._conn.execute("SELECT hash FROM chunks")}
+        if _has_legacy_blobs(self._conn):
+            self._known.update(row[0] for row in self._conn.execute("SELECT hash FROM blobs"))
+
+    def _store_text(self, text, new_chunks):
+        hashes = []
+        for chunk in split_chunks(text.encode("utf-8")):
+            key = chunk_key(chunk)
+            self.raw_bytes += len(chunk)
+            if key not in self._known and key not in new_chunks:
+                new_chunks[key] = chunk
+            hashes.append(key)
+        return json.dumps(hashes)
+
+    def _packs(self, new_chunks):
+        # i blocchi nuovi in pacchetti di circa PACK_SIZE byte: (dati, [(hash, offset, size)])
+        data, entries = [], []
+        offset = 0
+        for key, chunk in new_chunks.items():
+            data.append(chunk)
+            entries.append((key, offset, len(chunk)))
+            offset += len(chunk)
+            if offset >= PACK_SIZE:
+                yield b"".join(data), entries
+                data, entries, offset = [], [], 0
+        if entries:
+            yield b"".join(data), entries
+
+    def _write_batch(self, batch):
+        new_chunks = {}
+        rows = []
+        for row in batch:
+            rows.append((
+                row["index"],
+                row["agent_name"],
+                self._store_text(str(row["input_message"]), new_chunks),
+                self._store_text(str(row["response_text"]), new_chunks),
+                row["round"],
+                row["shap_explanation"],
+            ))
+        stored = 0
+        with self._conn:
+            for data, entries in self._packs(new_chunks):
+                codec, packed = compress(data)
+                pack_id = self._conn.execute(
+                    "INSERT INTO packs (codec, size, data) VALUES (?, ?, ?)", (codec, len(data), packed)
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO chunks (hash, pack, offset, size) VALUES (?, ?, ?, ?)",
+                    [(key, pack_id, offset, size) for key, offset, size in entries],
+                )
+                stored += len(packed)
+            self._conn.executemany(
+                "INSERT INTO transcripts (idx, agent_name, input_chunks, response_chunks, round, shap_explanation) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        # solo dopo il commit: se l'inserimento fallisce i blocchi non risultano salvati
+        self._known.update(new_chunks)
+        self.new_bytes += stored
+
+    def _close(self):
+        self._conn.close()
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"text_bytes": self.raw_bytes, "stored_bytes": self.new_bytes})
+        return stats
+
+
+class TranscriptStore:
+    """
+    Archivio dei log degli agenti (main.py --transcripts). write() accetta le stesse righe
+    di agent_responses.csv; rows() le ricostruisce con i testi completi.
+    """
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connect(path).close()
+        self.path = path
+        self._writer = _TranscriptWriter(path)
+        self._chunk_cache = LRUCache(maxsize=READ_CACHE_SIZE)
+        self._pack_cache = LRUCache(maxsize=PACK_CACHE_SIZE)
+
+    def write(self, row):
+        self._writer.write(row)
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+    def stats(self):
+        return self._writer.stats()
+
+    def _chunk(self, conn, key, legacy):
+        row = conn.execute("SELECT pack, offset, size FROM chunks WHERE hash = ?", (key,)).fetchone()
+        if row is None and legacy:
+            codec, data = conn.execute("SELECT codec, data FROM blobs WHERE hash = ?", (key,)).fetchone()
+            return decompress(codec, data)
+        if row is None:
+            raise KeyError(f"Chunk {key} missing from {self.path}")
+        pack_id, offset, size = row
+        pack = self._pack_cache.get(pack_id)
+        if pack is None:
+            codec, data = conn.execute("SELECT codec, data FROM packs WHERE id = ?", (pack_id,)).fetchone()
+            pack = decompress(codec, data)
+            self._pack_cache.set(pack_id, pack)
+        return pack[offset:offset + size]
+
+    def _text(self, conn, chunks_json, legacy):
+        # i blocchi possono tagliare un carattere UTF-8: si decodifica il testo intero
+        hashes = json.loads(chunks_json)
+        chunks = {}
+        for key in hashes:
+            if key not in chunks:
+                chunk = self._chunk_cache.get(key)
+                if chunk is None:
+                    chunk = self._chunk(conn, key, legacy)
+                    self._chunk_cache.set(key, chunk)
+                chunks[key] = chunk
+        return b"".join(chunks[key] for key in hashes).decode("utf-8")
+
+    def rows(self, index=None, agent_name=None):
+        """Genera le righe (dict con i campi di agent_responses.csv) nell'ordine di scrittura, filtrate per indice e agente."""
+        query = "SELECT idx, agent_name, input_chunks, response_chunks, round, shap_explanation FROM transcripts"
+        conditions, params = [], []
+        if index is not None:
+            conditions.append("idx = ?")
+            params.append(index)
+        if agent_name is not None:
+            conditions.append("agent_name = ?")
+            params.append(agent_name)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id"
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            legacy = _has_legacy_blobs(conn)
+            # il cursore viene letto riga per riga: l'export non carica tutte le righe in memoria
+            for idx, agent, input_chunks, response_chunks, round_count, shap_explanation in conn.execute(query, params):
+                yield {
+                    "index": idx,
+                    "agent_name": agent,
+                    "input_message": self._text(conn, input_chunks, legacy),
+                    "response_text": self._text(conn, response_chunks, legacy),
+                    "round": round_count,
+                    "shap_explanation": shap_explanation,
+                }
+        finally:
+            conn.close()
+
+    def size_report(self):
+        """
+        Byte dei testi nelle righe, byte dei blocchi distinti, byte compressi su disco e
+        rapporto compressi / distinti.
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            sizes = dict(conn.execute("SELECT hash, size FROM chunks"))
+            unique_bytes = sum(sizes.values())
+            stored_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM packs").fetchone()[0]
+            if _has_legacy_blobs(conn):
+                sizes.update(conn.execute("SELECT hash, size FROM blobs"))
+                legacy_unique, legacy_stored = conn.execute(
+                    "SELECT COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs"
+                ).fetchone()
+                unique_bytes += legacy_unique
+                stored_bytes += legacy_stored
+            text_bytes = 0
+            for input_chunks, response_chunks in conn.execute("SELECT input_chunks, response_chunks FROM transcripts"):
+                text_bytes += sum(sizes.get(key, 0) for key in json.loads(input_chunks) + json.loads(response_chunks))
+        finally:
+            conn.close()
+        return {
+            "text_bytes": text_bytes,
+            "unique_bytes": unique_bytes,
+            "stored_bytes": stored_bytes,
+            "compression_ratio": stored_bytes / unique_bytes if unique_bytes else 0.0,
+        }
+
+
+def export_csv(store, path, index=None):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    count = 0
+    with open(path, mode="w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for row in store.rows(index=index):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild agent_responses.csv from a main.py --transcripts store")
+    parser.add_argument("--db", type=str, required=True, help="Transcript store written by main.py --transcripts")
+    parser.add_argument("--output", type=str, default="agent_logs/agent_responses.csv", help="CSV file to write")
+    parser.add_argument("--index", type=int, default=None, help="Export only the rows of this article index")
+    args = parser.parse_args()
+
+    store = TranscriptStore(args.db)
+    rows = export_csv(store, args.output, index=args.index)
+    print(f"{args.output}: {rows} rows")
+    print(f"[TRANSCRIPTS] {store.size_report()}")
+    store.close()
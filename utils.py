@@ -23,8 +23,19 @@ llama3 = {
             "model": "llama3",  
             "base_url": "http://localhost:11434/v1", 
             "api_key": "ollama",  
-        }
-    ]
+            "timeout": 120,
+        },
+        # altre istanze Ollama: ogni chiamata va all'endpoint con meno richieste in corso
+        # {
+        #     "model": "llama3",
+        #     "base_url": "http://192.168.1.20:11434/v1",
+        #     "api_key": "ollama",
+        #     "timeout": 120,
+        # },
+    ],
+    # nessuna cache implicita di autogen (altrimenti cache_seed 41 in .cache/41):
+    # la cache delle risposte e' quella opzionale di llm_client (--llm-cache)
+    "cache_seed": None,
 }
 
 
@@ -3,6 +3,29 @@ import re
 import csv
 import os
 from agents import *
+from writers import get_writer
+
+# file dei log degli agenti (per-shard con --shard / --output-dir)
+AGENT_LOG_FILE = "agent_logs/agent_responses.csv"
+
+def set_agent_log_file(path):
+    global AGENT_LOG_FILE
+    AGENT_LOG_FILE = path
+
+# archivio SQLite opzionale (runstore.RunStore, main.py --run-store)
+RUN_STORE = None
+
+def set_run_store(store):
+    global RUN_STORE
+    RUN_STORE = store
+
+# archivio deduplicato dei log degli agenti (transcripts.TranscriptStore, main.py --transcripts):
+# se impostato sostituisce il file CSV
+TRANSCRIPT_STORE = None
+
+def set_transcript_store(store):
+    global TRANSCRIPT_STORE
+    TRANSCRIPT_STORE = store
 
 def is_valid_feedback_list(feedback_data):
     return (
@@ -188,7 +211,7 @@ def valid_sentence(response_text, agent, sentence_to_modify):
             correction = (
                 f"The format is incorrect.\nPlease use:\n{expected_format}\nRespond with JSON only."
             )
-            response = user_proxy.initiate_chat(agent, message=correction, clear_history=False)
+            response = chat(agent, correction, clear_history=False)
             response_text = response.summary
 
     return fallback
@@ -208,7 +231,7 @@ def valid_modifiedtext(response_text, agent, original_text):
             correction = (
                 f"The format is incorrect.\nPlease use:\n{expected_format}\nRespond with JSON only."
             )
-            response = user_proxy.initiate_chat(agent, message=correction, clear_history=False)
+            response = chat(agent, correction, clear_history=False)
             response_text = response.summary
 
     return fallback
@@ -228,12 +251,12 @@ def valid_feedback(response_text, agent, default_feedback="Please revise the con
             correction = (
                 f"The feedback format is invalid.\nPlease use:\n{expected_format}\nRespond only with JSON."
             )
-            response = user_proxy.initiate_chat(agent, message=correction, clear_history=False)
+            response = chat(agent, correction, clear_history=False)
             response_text = response.summary
 
     return fallback
 
-def valid_title(response_text, original_title):
+def valid_title(response_text, original_title, agent=TitleEditor):
     count = 0
     fallback = { "title": original_title }
     expected_format = '{ "title": "New title here" }'
@@ -248,7 +271,7 @@ def valid_title(response_text, original_title):
             correction = (
                 f"The response format is incorrect.\nUse:\n{expected_format}\nReturn only valid JSON."
             )
-            response = user_proxy.initiate_chat(TitleEditor, message=correction, clear_history=False)
+            response = chat(agent, correction, clear_history=False)
             response_text = response.summary
 
     return fallback
@@ -284,13 +307,13 @@ def valid_semantic(response_text, agent, original_text):
             correction = (
                 f"The JSON is invalid or incomplete.\nUse format:\n{expected_format}\nOnly JSON allowed."
             )
-            response = user_proxy.initiate_chat(agent, message=correction, clear_history=False)
+            response = chat(agent, correction, clear_history=False)
             response_text = response.summary
 
     return fallback
 
 
-def valid_evaluator(response_text):
+def valid_evaluator(response_text, agent=EvaluatorAgent):
     count = 0
     fallback = {
         "feedback": [
@@ -323,20 +346,15 @@ def valid_evaluator(response_text):
                 f"Please return your response using exactly this format:\n{expected_format}\n"
                 "Respond with only valid JSON."
             )
-            response = user_proxy.initiate_chat(EvaluatorAgent, message=correction, clear_history=False)
+            response = chat(agent, correction, clear_history=False)
             response_text = response.summary
 
     return fallback
 
 def log_agent_response(index, agent_name, input_message, response_text, round_count, shap_words=None, shap_phrases=None):
-    log_file = "agent_logs/agent_responses.csv"
-    os.makedirs("agent_logs", exist_ok=True)
+    log_file = AGENT_LOG_FILE
 
     fieldnames = ["index", "agent_name", "input_message", "response_text", "round", "shap_explanation"]
-    if not os.path.exists(log_file):
-        with open(log_file, mode="w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
 
     shap_explanation = ""
     if shap_words or shap_phrases:
@@ -347,13 +365,17 @@ def log_agent_response(index, agent_name, input_message, response_text, round_co
     )
 
 
-    with open(log_file, mode="a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writerow({
-            "index": index,
-            "agent_name": agent_name,
-            "input_message": input_message,
-            "response_text": response_text,
-            "round": round_count,
-            "shap_explanation": shap_explanation
-        })
+    row = {
+        "index": index,
+        "agent_name": agent_name,
+        "input_message": input_message,
+        "response_text": response_text,
+        "round": round_count,
+        "shap_explanation": shap_explanation
+    }
+    if TRANSCRIPT_STORE is not None:
+        TRANSCRIPT_STORE.write(row)
+    else:
+        get_writer(log_file, fieldnames=fieldnames).write(row)
+    if RUN_STORE is not None:
+        RUN_STORE.add_agent_call(index, agent_name, input_message, response_text, round_count, shap_explanation)
@@ -0,0 +1,196 @@
+import atexit
+import csv
+import os
+import queue
+import threading
+import time
+
+# Scrittura in background dei file di output (metriche, output, tempi, log degli agenti):
+# un thread per destinazione, che riceve le righe da una coda e le scrive a blocchi.
+
+MAX_BATCH = 256     # righe per scrittura
+MAX_DELAY = 1.0     # secondi massimi tra l'arrivo di una riga e la sua scrittura
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """
+    Thread dedicato che riceve elementi da una coda e li scrive a blocchi: write() accoda e
+    ritorna subito, il blocco viene scritto quando raggiunge max_batch elementi o dopo
+    max_delay secondi. Le sottoclassi implementano _open, _write_batch e _close.
+    """
+    def __init__(self, name, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.name = name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.rows_written = 0
+        self.batches = 0
+        self.error = None
+        self._closed = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"writer:{name}", daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        if self._closed:
+            raise RuntimeError(f"writer for {self.name} is closed")
+        self._queue.put(row)
+
+    def flush(self):
+        """
+        Attende che tutti gli elementi accodati finora siano scritti. Se una scrittura del writer
+        e' fallita solleva RuntimeError: non si sa quali righe manchino, quindi l'errore resta
+        e viene sollevato a ogni flush successivo.
+        """
+        if not self._closed:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+        if self.error is not None:
+            raise RuntimeError(f"writer for {self.name} failed, rows may be missing: {self.error}") from self.error
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _open(self):
+        pass
+
+    def _write_batch(self, batch):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def _flush_batch(self, opened, batch):
+        if not opened:
+            print(f"[WRITER] Dropping {len(batch)} rows for {self.name}: {self.error}")
+            return
+        try:
+            self._write_batch(batch)
+            self.rows_written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            # l'errore non deve bloccare chi attende flush(); viene segnalato e conservato
+            self.error = e
+            print(f"[WRITER] Error writing {len(batch)} rows to {self.name}: {e}")
+
+    def _run(self):
+        try:
+            self._open()
+            opened = True
+        except Exception as e:
+            # si continua a svuotare la coda, cosi' flush() e close() non restano bloccati
+            opened = False
+            self.error = e
+            print(f"[WRITER] Cannot open {self.name}: {e}")
+        batch = []
+        deadline = None
+        stop = False
+        while not stop:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            flush_events = []
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, threading.Event):
+                flush_events.append(item)
+            elif item is not None:
+                batch.append(item)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.max_delay
+
+            if batch and (stop or flush_events or len(batch) >= self.max_batch or time.monotonic() >= deadline):
+                self._flush_batch(opened, batch)
+                batch = []
+            for event in flush_events:
+                event.set()
+        if opened:
+            self._close()
+
+    def stats(self):
+        return {"rows": self.rows_written, "batches": self.batches, "queued": self._queue.qsize()}
+
+
+class BackgroundCSVWriter(BackgroundWriter):
+    """
+    Writer in background per un file CSV. Righe come liste (header opzionale) o come dict
+    (fieldnames). Il file resta aperto in append; l'intestazione viene scritta solo se il
+    file e' nuovo o vuoto.
+    """
+    def __init__(self, path, header=None, fieldnames=None, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.path = path
+        self.header = header
+        self.fieldnames = fieldnames
+        self._file = None
+        self._writer = None
+        super().__init__(path, max_batch=max_batch, max_delay=max_delay)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, mode="a", newline="", encoding="utf-8")
+        if self.fieldnames:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction="ignore")
+            if new_file:
+                self._writer.writeheader()
+        else:
+            self._writer = csv.writer(self._file)
+            if new_file and self.header:
+                self._writer.writerow(self.header)
+
+    def _write_batch(self, batch):
+        self._writer.writerows(batch)
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+_writers = {}
+_lock = threading.Lock()
+
+
+def get_writer(path, header=None, fieldnames=None):
+    """Writer in background condiviso per il file (uno per percorso)."""
+    with _lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = BackgroundCSVWriter(path, header=header, fieldnames=fieldnames)
+    return writer
+
+
+def flush_all():
+    """flush() di tutti i writer; se qualcuno e' fallito, dopo averli svuotati tutti solleva il primo errore."""
+    with _lock:
+        writers = list(_writers.values())
+    errors = []
+    for writer in writers:
+        try:
+            writer.flush()
+        except RuntimeError as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+
+def close_all():
+    """Scrive le righe ancora in coda e chiude tutti i file (registrata con atexit)."""
+    with _lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_all)